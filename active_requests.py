@@ -0,0 +1,21 @@
+from config import REQUESTS_SHEET, RequestFields, RequestStatus
+
+ACTIVE_STATUSES = [RequestStatus.CHECK, RequestStatus.RUN]
+
+class ActiveRequests:
+    """Активные заявки по времени создания; пересчитываются только при изменении листа Requests."""
+
+    def __init__(self, requests):
+        self.all = sorted(requests, key=lambda req: req[RequestFields.CREATED_AT] or '')
+        self.by_user = {}
+        for req in self.all:
+            self.by_user.setdefault(req[RequestFields.USER_ID], []).append(req)
+
+    def for_user(self, user_id):
+        return self.by_user.get(str(user_id), [])
+
+async def get_active_requests(sheet_manager):
+    return await sheet_manager.get_derived(
+        REQUESTS_SHEET, 'active_requests', ActiveRequests,
+        filters={RequestFields.STATUS: ACTIVE_STATUSES}
+    )
@@ -1,15 +1,33 @@
+from contextlib import suppress
 from datetime import datetime
 import math
 from aiogram import Router, F
-from aiogram.filters import Command
-from aiogram.types import Message, CallbackQuery
+from aiogram.filters import Command, CommandObject
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import BufferedInputFile, Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from config import USERS_SHEET, REQUESTS_SHEET, ButtonTexts, Messages, RequestFields, RequestStatus, UserFields, UserStatus
+from config import ROLLUP_DEFAULT_PERIODS, ROLLUP_MAX_PERIODS, USERS_SHEET, REQUESTS_SHEET, ButtonTexts, Messages, RequestFields, RequestStatus, UserFields, UserStatus, is_admin
+from active_requests import get_active_requests
+from outbound import bulk_sends
+from request_archive import FINISHED_STATUSES
+from reports import build_completed_report, iter_chunks, parse_report_filters
 from uiux import UIUX
 
 admin_router = Router()
 
+async def is_admin_user(event) -> bool:
+    """Администратор из ADMIN_IDS или пользователь со статусом администратора в таблице."""
+    user_id = str(event.from_user.id)
+    if is_admin(user_id):
+        return True
+    user_data = await admin_router.sheet_manager.get_data(USERS_SHEET, user_id)
+    return bool(user_data) and user_data.get(UserFields.USER_STATUS) == UserStatus.ADMIN
+
+# Команды и кнопки ниже доступны только администраторам, остальным роутер их не показывает
+admin_router.message.filter(is_admin_user)
+admin_router.callback_query.filter(is_admin_user)
+
 class AdminStates(StatesGroup):
     # waiting_for_completion_message = State()
     waiting_for_rejection_message = State()
@@ -21,7 +39,7 @@ async def cmd_admin(message: Message):
 @admin_router.message(F.text == ButtonTexts.FRIENDS)
 async def show_friends(message: Message):
     sheet_manager = admin_router.sheet_manager
-    all_users = sheet_manager.get_data(USERS_SHEET)
+    all_users = await sheet_manager.get_data(USERS_SHEET)
     active_users = [user for user in all_users if user[UserFields.USER_STATUS] == UserStatus.ACTIVE]
     
     response = Messages.ALL_USERS.format(total=len(all_users))
@@ -38,85 +56,156 @@ async def show_friends(message: Message):
 
 @admin_router.message(F.text == ButtonTexts.REQUESTS)
 async def show_admin_requests(message: Message):
-    sheet_manager = admin_router.sheet_manager
-    all_requests = sheet_manager.get_data(REQUESTS_SHEET)
+    active_requests = await get_active_requests(admin_router.sheet_manager)
     
-    active_requests = [req for req in all_requests if req[RequestFields.STATUS] in [RequestStatus.CHECK, RequestStatus.RUN]]
-    
-    if not active_requests:
+    if not active_requests.all:
         await message.answer(Messages.NO_REQUESTS, reply_markup=UIUX.admin_menu())
         return
     
-    for req in active_requests:
-        await message.answer(
-            UIUX.format_request(req, is_admin=True),
-            reply_markup=UIUX.admin_request_actions(req[RequestFields.REQUEST_ID], req[RequestFields.STATUS]),
-            parse_mode="Markdown"
-        )
-    
-    await message.answer(Messages.ADMIN_MENU_MESSAGE, reply_markup=UIUX.admin_menu())
+    text, keyboard = UIUX.requests_page(active_requests.all, 0, is_admin=True)
+    await message.answer(text, reply_markup=keyboard, parse_mode="Markdown")
+
+async def render_requests_page(page):
+    """Текст и клавиатура страницы списка активных заявок для администратора."""
+    active_requests = await get_active_requests(admin_router.sheet_manager)
+    if not active_requests.all:
+        return Messages.NO_REQUESTS, None
+    return UIUX.requests_page(active_requests.all, page, is_admin=True)
+
+async def refresh_requests_page(bot, chat_id, message_id, page):
+    text, keyboard = await render_requests_page(page)
+    with suppress(TelegramBadRequest):  # Страница не изменилась
+        await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id, reply_markup=keyboard, parse_mode="Markdown")
+
+@admin_router.callback_query(F.data.startswith("admin_requests_page_"))
+async def turn_admin_requests_page(callback: CallbackQuery):
+    await callback.answer()
+    await refresh_requests_page(callback.bot, callback.message.chat.id, callback.message.message_id, int(callback.data.split('_')[-1]))
 
 @admin_router.message(F.text == ButtonTexts.COMPLETED_REQUESTS)
-async def show_completed_requests(message: Message):
-    sheet_manager = admin_router.sheet_manager
-    all_requests = sheet_manager.get_data(REQUESTS_SHEET)
-    
-    completed_requests = [req for req in all_requests if req[RequestFields.STATUS] == RequestStatus.DONE]
-    
-    if not completed_requests:
-        await message.answer(Messages.NO_COMPLETED_REQUESTS, reply_markup=UIUX.admin_menu())
+@admin_router.message(Command("completed"))
+async def show_completed_requests(message: Message, command: CommandObject = None):
+    try:
+        date_from, date_to, pair = parse_report_filters(command.args if command else None)
+    except ValueError:
+        await message.answer(Messages.COMPLETED_REQUESTS_USAGE, reply_markup=UIUX.admin_menu())
         return
+
+    chunks, document = await build_completed_report(admin_router.sheet_manager, date_from, date_to, pair, admin_router.archive)
     
-    response = Messages.COMPLETED_REQUESTS_HEADER
-    for req in completed_requests:
-        user_data = sheet_manager.get_data(USERS_SHEET, req[RequestFields.USER_ID])
-        username = user_data[UserFields.USERNAME] if user_data else Messages.UNKNOWN_USER
-        completed_date = datetime.strptime(req[RequestFields.UPDATED_AT], "%Y-%m-%dT%H:%M:%S.%f").strftime("%d/%m/%y")
-        response += (
-            f"@{username}: {math.ceil(float(req[RequestFields.AMOUNT])):,} {req[RequestFields.SOURCE_CURRENCY]} -> "
-            f"{math.ceil(float(req[RequestFields.RESULT])):,} {req[RequestFields.TARGET_CURRENCY]}, {completed_date}\n"
+    if document:
+        await message.answer_document(
+            BufferedInputFile(document.encode('utf-8'), filename='completed_requests.txt'),
+            reply_markup=UIUX.admin_menu()
         )
+        return
+    if not chunks:
+        await message.answer(Messages.NO_COMPLETED_REQUESTS, reply_markup=UIUX.admin_menu())
+        return
     
-    await message.answer(response, reply_markup=UIUX.admin_menu())
+    with bulk_sends():
+        for chunk in chunks[:-1]:
+            await message.answer(chunk)
+    await message.answer(chunks[-1], reply_markup=UIUX.admin_menu())
 
 @admin_router.message(F.text == ButtonTexts.ANALYTICS)
 async def show_analytics(message: Message):
-    sheet_manager = admin_router.sheet_manager
-    all_users = sheet_manager.get_data(USERS_SHEET)
-    all_requests = sheet_manager.get_data(REQUESTS_SHEET)
-    
-    total_users = len(all_users)
-    total_exchanges = len([req for req in all_requests if req[RequestFields.STATUS] == RequestStatus.DONE])
-    
-    if total_exchanges > 0:
-        average_exchange_volume = sum(math.ceil(float(req[RequestFields.AMOUNT])) for req in all_requests if req[RequestFields.STATUS] == RequestStatus.DONE) / total_exchanges
-    else:
-        average_exchange_volume = 0
-
-    currency_pairs = [(req[RequestFields.SOURCE_CURRENCY], req[RequestFields.TARGET_CURRENCY]) for req in all_requests if req[RequestFields.STATUS] == RequestStatus.DONE]
-    most_popular_pair = max(set(currency_pairs), key=currency_pairs.count) if currency_pairs else None
+    summary = await admin_router.analytics.get_summary()
+    most_popular_pair = summary['most_popular_pair']
 
     response = Messages.ANALYTICS_HEADER
-    response += Messages.TOTAL_USERS.format(total_users=total_users)
-    response += Messages.TOTAL_EXCHANGES.format(total_exchanges=total_exchanges)
-    response += Messages.AVERAGE_EXCHANGE_VOLUME.format(average_volume=math.ceil(average_exchange_volume))
+    response += Messages.TOTAL_USERS.format(total_users=summary['total_users'])
+    response += Messages.TOTAL_EXCHANGES.format(total_exchanges=summary['total_exchanges'])
+    response += Messages.AVERAGE_EXCHANGE_VOLUME.format(average_volume=math.ceil(summary['average_volume']))
     response += Messages.MOST_POPULAR_PAIR.format(pair=' -> '.join(most_popular_pair) if most_popular_pair else Messages.NO_DATA)
     
     await message.answer(response, reply_markup=UIUX.admin_menu())
 
+@admin_router.message(Command("request"))
+async def show_request(message: Message, command: CommandObject):
+    request_id = (command.args or '').strip().upper()
+    if not request_id:
+        await message.answer(Messages.REQUEST_LOOKUP_USAGE, reply_markup=UIUX.admin_menu())
+        return
+
+    # Текущие заявки берутся из кэша, завершенные давно — из архива
+    request = await admin_router.sheet_manager.get_data(REQUESTS_SHEET, request_id)
+    if not request:
+        request = await admin_router.archive.get(request_id)
+    if not request:
+        await message.answer(Messages.REQUEST_NOT_FOUND.format(request_id=request_id), reply_markup=UIUX.admin_menu())
+        return
+    await message.answer(UIUX.format_request(request, is_admin=True), reply_markup=UIUX.admin_menu(), parse_mode="Markdown")
+
+@admin_router.message(Command("schema"))
+async def refresh_schema(message: Message):
+    # После перестановки колонок в таблице вручную, не дожидаясь перезагрузки листов
+    changed = await admin_router.sheet_manager.refresh_schemas()
+    text = Messages.SCHEMA_UPDATED.format(sheets=', '.join(changed)) if changed else Messages.SCHEMA_UNCHANGED
+    await message.answer(text, reply_markup=UIUX.admin_menu())
+
+@admin_router.message(Command("daily", "weekly"))
+async def show_rollups(message: Message, command: CommandObject):
+    period = 'day' if command.command == 'daily' else 'week'
+    try:
+        count = int(command.args) if command.args else ROLLUP_DEFAULT_PERIODS[period]
+    except ValueError:
+        await message.answer(Messages.ROLLUP_USAGE, reply_markup=UIUX.admin_menu())
+        return
+    count = min(max(count, 1), ROLLUP_MAX_PERIODS)
+
+    rollups = await admin_router.analytics.get_rollups(period, count)
+    if not rollups:
+        await message.answer(Messages.NO_DATA, reply_markup=UIUX.admin_menu())
+        return
+
+    lines = []
+    for start, pairs in rollups:
+        lines.append(Messages.ROLLUP_PERIOD.format(period=start.strftime("%d/%m/%y")))
+        for (source, target), bucket in sorted(pairs.items()):
+            lines.append(Messages.ROLLUP_PAIR.format(
+                source=source,
+                target=target,
+                count=bucket.count,
+                volume=math.ceil(bucket.volume),
+                median=math.ceil(bucket.percentile(0.5)),
+                p95=math.ceil(bucket.percentile(0.95))
+            ))
+    chunks = list(iter_chunks(lines, Messages.ROLLUP_HEADERS[period]))
+    with bulk_sends():
+        for chunk in chunks[:-1]:
+            await message.answer(chunk, parse_mode="Markdown")
+    await message.answer(chunks[-1], reply_markup=UIUX.admin_menu(), parse_mode="Markdown")
+
+async def set_request_status(request_id, status):
+    """Меняет статус заявки и учитывает изменение в аналитике. Возвращает данные заявки."""
+    sheet_manager = admin_router.sheet_manager
+    old_data = await sheet_manager.get_data(REQUESTS_SHEET, request_id)
+    old_status = old_data[RequestFields.STATUS] if old_data else None
+    await sheet_manager.batch_update(REQUESTS_SHEET, request_id, {
+        RequestFields.STATUS: status,
+        RequestFields.UPDATED_AT: datetime.now().isoformat()
+    })
+    request_data = await sheet_manager.get_data(REQUESTS_SHEET, request_id)
+    await admin_router.analytics.apply_status_change(request_data, old_status, status)
+    if status in FINISHED_STATUSES:
+        admin_router.archive.request_finished()
+    return request_data
+
 @admin_router.callback_query(F.data.startswith("admin_accept_"))
 async def admin_accept_request(callback: CallbackQuery):
-    sheet_manager = admin_router.sheet_manager
-    request_id = callback.data.split('_')[-1]
-    sheet_manager.batch_update(REQUESTS_SHEET, request_id, {RequestFields.STATUS: RequestStatus.RUN})
-    await callback.answer(Messages.REQUEST_ACCEPTED)
+    request_id, page = UIUX.parse_request_action(callback.data)
+    request_data = await set_request_status(request_id, RequestStatus.RUN)
+    await callback.answer(Messages.REQUEST_ACCEPTED.format(request_id=request_id))
     
-    request_data = sheet_manager.get_data(REQUESTS_SHEET, request_id)
-    await callback.message.edit_text(
-        UIUX.format_request(request_data),
-        reply_markup=UIUX.admin_request_actions(request_id, RequestStatus.RUN),
-        parse_mode="Markdown"
-    )
+    if page is not None:
+        await refresh_requests_page(callback.bot, callback.message.chat.id, callback.message.message_id, page)
+    else:
+        await callback.message.edit_text(
+            UIUX.format_request(request_data),
+            reply_markup=UIUX.admin_request_actions(request_id, RequestStatus.RUN),
+            parse_mode="Markdown"
+        )
     
     # Уведомление пользователя
     user_id = request_data[RequestFields.USER_ID]
@@ -124,10 +213,15 @@ async def admin_accept_request(callback: CallbackQuery):
 
 @admin_router.callback_query(F.data.startswith("admin_reject_"))
 async def admin_reject_request(callback: CallbackQuery, state: FSMContext):
-    sheet_manager = admin_router.sheet_manager
-    request_id = callback.data.split('_')[-1]
-    await state.update_data(request_id=request_id)
-    await callback.message.edit_text(Messages.ENTER_REJECTION_MESSAGE, reply_markup=None)
+    request_id, page = UIUX.parse_request_action(callback.data)
+    await callback.answer()
+    if page is not None:
+        # Страницу не трогаем: после ввода причины она перерисуется без отмененной заявки
+        await state.update_data(request_id=request_id, page=page, page_message_id=callback.message.message_id)
+        await callback.message.answer(Messages.ENTER_REJECTION_MESSAGE)
+    else:
+        await state.update_data(request_id=request_id)
+        await callback.message.edit_text(Messages.ENTER_REJECTION_MESSAGE, reply_markup=None)
     await state.set_state(AdminStates.waiting_for_rejection_message)
 
 @admin_router.message(AdminStates.waiting_for_rejection_message)
@@ -136,30 +230,30 @@ async def process_rejection_message(message: Message, state: FSMContext):
     user_data = await state.get_data()
     request_id = user_data['request_id']
     
-    sheet_manager.batch_update(REQUESTS_SHEET, request_id, {RequestFields.STATUS: RequestStatus.CANCEL})
-    
-    request_data = sheet_manager.get_data(REQUESTS_SHEET, request_id)
+    request_data = await set_request_status(request_id, RequestStatus.CANCEL)
     user_id = request_data[RequestFields.USER_ID]
     
     await notify_user_status_change(user_id, request_id, RequestStatus.CANCEL, message.text)
     
     await message.answer(Messages.ADMIN_REQUEST_REJECTED, reply_markup=UIUX.admin_menu())
+    if user_data.get('page') is not None:
+        await refresh_requests_page(message.bot, message.chat.id, user_data['page_message_id'], user_data['page'])
     await state.clear()
 
 @admin_router.callback_query(F.data.startswith("admin_complete_"))
 async def admin_complete_request(callback: CallbackQuery, state: FSMContext):
-    sheet_manager = admin_router.sheet_manager
-    request_id = callback.data.split('_')[-1]
+    request_id, page = UIUX.parse_request_action(callback.data)
     
-    sheet_manager.batch_update(REQUESTS_SHEET, request_id, {RequestFields.STATUS: RequestStatus.DONE})
-    
-    request_data = sheet_manager.get_data(REQUESTS_SHEET, request_id)
+    request_data = await set_request_status(request_id, RequestStatus.DONE)
     user_id = request_data[RequestFields.USER_ID]
     
     await notify_user_status_change(user_id, request_id, RequestStatus.DONE)
     
-    await callback.message.edit_text(Messages.ADMIN_REQUEST_COMPLETED, reply_markup=None)
     await callback.answer(Messages.ADMIN_REQUEST_COMPLETED)
+    if page is not None:
+        await refresh_requests_page(callback.bot, callback.message.chat.id, callback.message.message_id, page)
+    else:
+        await callback.message.edit_text(Messages.ADMIN_REQUEST_COMPLETED, reply_markup=None)
 
 # @admin_router.message(AdminStates.waiting_for_completion_message)
 # async def process_completion_message(message: Message, state: FSMContext):
@@ -172,10 +266,10 @@ async def admin_complete_request(callback: CallbackQuery, state: FSMContext):
 #         await state.clear()
 #         return
 
-#     sheet_manager.batch_update(REQUESTS_SHEET, request_id, {RequestFields.STATUS: RequestStatus.DONE})
+#     await sheet_manager.batch_update(REQUESTS_SHEET, request_id, {RequestFields.STATUS: RequestStatus.DONE})
     
 #     # Уведомление пользователя
-#     request_data = sheet_manager.get_data(REQUESTS_SHEET, request_id)
+#     request_data = await sheet_manager.get_data(REQUESTS_SHEET, request_id)
 #     user_id = request_data[RequestFields.USER_ID]
     
 #     await notify_user_status_change(user_id, request_id, RequestStatus.DONE, message.text)
@@ -201,9 +295,3 @@ async def notify_user_status_change(user_id, request_id, status, message=None):
 async def notify_admin_request_cancelled(bot, admin_id, request_id):
     message = Messages.USER_CANCELLED_REQUEST.format(request_id=request_id)
     await bot.send_message(chat_id=admin_id, text=message)
-
-async def notify_admin(bot, sheet_manager, message, keyboard=None):
-    admin_users = [user for user in sheet_manager.get_data(USERS_SHEET) if user[UserFields.USER_STATUS] == 'admin']
-    for admin in admin_users:
-        formatted_message = UIUX.format_notification(message)
-        await bot.send_message(chat_id=admin[UserFields.USER_ID], text=formatted_message, reply_markup=keyboard, parse_mode="Markdown")
@@ -0,0 +1,256 @@
+import logging
+import math
+from array import array
+from collections import Counter
+from contextlib import suppress
+from datetime import date, datetime, timedelta
+
+from config import (
+    ANALYTICS_SHEET, REQUESTS_SHEET, USERS_SHEET, AnalyticsFields, RequestFields, RequestStatus
+)
+
+logger = logging.getLogger(__name__)
+
+class RollupBucket:
+    """Обмены одной пары за один период: число, объем и суммы заявок для перцентилей."""
+    __slots__ = ('count', 'volume', 'amounts', '_sorted')
+
+    def __init__(self):
+        self.count = 0
+        self.volume = 0.0
+        self.amounts = array('d')
+        self._sorted = True
+
+    def add(self, amount):
+        self.count += 1
+        self.volume += amount
+        if self.amounts and amount < self.amounts[-1]:
+            self._sorted = False
+        self.amounts.append(amount)
+
+    def remove(self, amount):
+        self.count -= 1
+        self.volume -= amount
+        with suppress(ValueError):
+            self.amounts.remove(amount)
+
+    def percentile(self, share):
+        if not self.amounts:
+            return 0
+        if not self._sorted:
+            self.amounts = array('d', sorted(self.amounts))
+            self._sorted = True
+        # Метод ближайшего ранга
+        return self.amounts[max(0, math.ceil(share * len(self.amounts)) - 1)]
+
+class Rollups:
+    """Сводки по парам валют за дни и недели: period -> начало периода -> пара -> RollupBucket."""
+
+    PERIODS = ('day', 'week')
+
+    def __init__(self):
+        self.buckets = {period: {} for period in self.PERIODS}
+
+    @staticmethod
+    def bucket_start(period, day):
+        return day - timedelta(days=day.weekday()) if period == 'week' else day
+
+    def add(self, day, pair, amount, sign=1):
+        for period in self.PERIODS:
+            start = self.bucket_start(period, day)
+            if sign > 0:
+                self.buckets[period].setdefault(start, {}).setdefault(pair, RollupBucket()).add(amount)
+                continue
+            pairs = self.buckets[period].get(start, {})
+            if pair in pairs:
+                pairs[pair].remove(amount)
+                if pairs[pair].count <= 0:
+                    del pairs[pair]
+                if not pairs:
+                    del self.buckets[period][start]
+
+    def last(self, period, count, today=None):
+        """[(начало периода, {пара: RollupBucket})] за последние count периодов, от новых к старым."""
+        start = self.bucket_start(period, today or date.today())
+        step = timedelta(days=7 if period == 'week' else 1)
+        result = []
+        for _ in range(count):
+            pairs = self.buckets[period].get(start)
+            if pairs:
+                result.append((start, pairs))
+            start -= step
+        return result
+
+class AnalyticsEngine:
+    """Агрегаты для кнопки «Аналитика» и сводки по периодам, которые не пересчитываются на каждый запрос.
+
+    Смены статуса заявок учитываются инкрементально (apply_status_change), а с нуля
+    агрегаты пересобираются только после перезагрузки листа Requests. Выполненные
+    заявки из архива читаются один раз и хранятся в виде кортежей из нужных полей.
+    Значения сохраняются в лист Analytics: строка на метрику, пары — как pair:ИЗ->В.
+    """
+
+    TOTAL_USERS = 'total_users'
+    COMPLETED_EXCHANGES = 'completed_exchanges'
+    EXCHANGE_VOLUME = 'exchange_volume'
+    PAIR_PREFIX = 'pair:'
+
+    def __init__(self, sheet_manager, archive=None):
+        self.sheet_manager = sheet_manager
+        self.archive = archive
+        self._archived = None  # записи _entry выполненных заявок из архива
+        self.completed = 0
+        self.volume = 0
+        self.pairs = Counter()
+        self.rollups = Rollups()
+        self._stale = True
+        self._generation = 0  # растет при изменениях, которые пересчет мог не увидеть
+        self._persisted = {}
+        sheet_manager.reload_listeners.append(self._on_reload)
+        if archive:
+            archive.listeners.append(self._on_archived)
+
+    def _on_reload(self, sheet_name):
+        if sheet_name == REQUESTS_SHEET:
+            self._stale = True
+            self._generation += 1
+
+    def _on_archived(self, requests):
+        # Лист Requests уже перезагружен, поэтому агрегаты пересоберутся и учтут эти заявки здесь
+        if self._archived is not None:
+            self._archived.extend(self._entry(request) for request in requests if request[RequestFields.STATUS] == RequestStatus.DONE)
+
+    @classmethod
+    def _entry(cls, request):
+        """(id, пара, сумма, день завершения) — все, что агрегатам нужно от заявки."""
+        return (request[RequestFields.REQUEST_ID], cls._pair(request), request[RequestFields.AMOUNT], cls._completed_day(request))
+
+    @staticmethod
+    def _amount(request_id, amount):
+        try:
+            return math.ceil(float(amount))
+        except (TypeError, ValueError):
+            logger.warning(f"Request {request_id} has invalid amount: {amount}")
+            return 0
+
+    @staticmethod
+    def _pair(request):
+        return (request[RequestFields.SOURCE_CURRENCY], request[RequestFields.TARGET_CURRENCY])
+
+    @staticmethod
+    def _completed_day(request):
+        timestamp = request[RequestFields.UPDATED_AT] or request[RequestFields.CREATED_AT] or ''
+        try:
+            return date.fromisoformat(timestamp[:10])
+        except ValueError:
+            return None
+
+    def _add(self, entry, sign):
+        request_id, pair, amount, day = entry
+        self.completed += sign
+        self.volume += sign * self._amount(request_id, amount)
+        self.pairs[pair] += sign
+        if self.pairs[pair] <= 0:
+            del self.pairs[pair]
+
+        if day is not None:
+            try:
+                amount = float(amount)
+            except (TypeError, ValueError):
+                return
+            self.rollups.add(day, pair, amount, sign)
+
+    async def _ensure_built(self):
+        while self._stale:
+            generation = self._generation
+            archive_failed = False
+            completed = await self.sheet_manager.query(REQUESTS_SHEET, {RequestFields.STATUS: RequestStatus.DONE})
+            if self.archive and self._archived is None:
+                try:
+                    archived = await self.archive.load()
+                    self._archived = [self._entry(request) for request in archived if request[RequestFields.STATUS] == RequestStatus.DONE]
+                except Exception as e:
+                    logger.error(f"Failed to load archived requests, analytics will cover recent requests only: {e}")
+                    archive_failed = True
+            self._rebuild(completed)
+            if self._generation != generation and not archive_failed:
+                # Статус заявки сменился, пока читались данные, — снимок мог его не увидеть
+                continue
+            self._stale = archive_failed
+            logger.info(f"Rebuilt analytics from {self.completed} completed requests")
+            if not self._stale:
+                # Без архива итоги неполные — не перезаписываем ими лист Analytics
+                await self._persist()
+            return
+
+    def _rebuild(self, completed):
+        entries = [self._entry(request) for request in completed]
+        hot_ids = {entry[0] for entry in entries}
+        self.completed = 0
+        self.volume = 0
+        self.pairs = Counter()
+        self.rollups = Rollups()
+        for entry in self._archived or []:
+            # Заявка, которую не успели удалить с листа Requests после переноса, учитывается один раз
+            if entry[0] not in hot_ids:
+                self._add(entry, 1)
+        for entry in entries:
+            self._add(entry, 1)
+
+    async def apply_status_change(self, request, old_status, new_status):
+        """Учитывает смену статуса заявки; request — данные заявки до или после изменения."""
+        if old_status == new_status:
+            return
+        if self._stale:
+            # Итоги еще пересчитываются или будут пересчитаны — изменение попадет в них
+            self._generation += 1
+            return
+        if new_status == RequestStatus.DONE:
+            self._add(self._entry(request), 1)
+        elif old_status == RequestStatus.DONE:
+            self._add(self._entry(request), -1)
+        else:
+            return
+        await self._persist()
+
+    async def get_summary(self):
+        await self._ensure_built()
+        most_popular = max(self.pairs.items(), key=lambda item: item[1])[0] if self.pairs else None
+        return {
+            'total_users': await self.sheet_manager.count(USERS_SHEET),
+            'total_exchanges': self.completed,
+            'average_volume': self.volume / self.completed if self.completed else 0,
+            'most_popular_pair': most_popular,
+        }
+
+    async def get_rollups(self, period, count):
+        await self._ensure_built()
+        return self.rollups.last(period, count)
+
+    async def _persist(self):
+        if ANALYTICS_SHEET not in self.sheet_manager.sheets:
+            return
+        metrics = {
+            self.TOTAL_USERS: await self.sheet_manager.count(USERS_SHEET),
+            self.COMPLETED_EXCHANGES: self.completed,
+            self.EXCHANGE_VOLUME: self.volume,
+        }
+        for (source, target), count in self.pairs.items():
+            metrics[f"{self.PAIR_PREFIX}{source}->{target}"] = count
+        # Пары, по которым больше нет обменов, обнуляем, а не удаляем строки
+        for metric in self._persisted:
+            metrics.setdefault(metric, 0)
+
+        now = datetime.now().isoformat()
+        try:
+            for metric, value in metrics.items():
+                if self._persisted.get(metric) == value:
+                    continue
+                data = {AnalyticsFields.VALUE: str(value), AnalyticsFields.LAST_UPDATED: now}
+                if await self.sheet_manager.get_data(ANALYTICS_SHEET, metric):
+                    await self.sheet_manager.batch_update(ANALYTICS_SHEET, metric, data)
+                else:
+                    await self.sheet_manager.add_new_entry(ANALYTICS_SHEET, {AnalyticsFields.METRIC: metric, **data})
+                self._persisted[metric] = value
+        except Exception as e:
+            logger.error(f"Failed to save analytics: {e}", exc_info=True)
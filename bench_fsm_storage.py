@@ -0,0 +1,60 @@
+"""Сравнение MemoryStorage и SQLiteStorage на типичном шаге FSM-диалога.
+
+Запуск: python bench_fsm_storage.py --users 10000 --steps 5
+На каждое «сообщение» выполняется то же, что делает aiogram с хэндлером обмена:
+get_state, get_data, update_data и set_state.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+os.environ.setdefault('ADMIN_ID_1', '0')
+os.environ.setdefault('ADMIN_ID_2', '0')
+
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from fsm_storage import SQLiteStorage
+from states import ExchangeStates
+
+async def simulate(storage, users, steps):
+    states = [ExchangeStates.choosing_source, ExchangeStates.choosing_target, ExchangeStates.entering_amount]
+    started = time.perf_counter()
+    for step in range(steps):
+        for user_id in range(users):
+            key = StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+            await storage.get_state(key)
+            await storage.get_data(key)
+            await storage.update_data(key, {'step': step, 'amount': str(user_id * 10)})
+            await storage.set_state(key, states[step % len(states)])
+    return time.perf_counter() - started
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10_000)
+    parser.add_argument('--steps', type=int, default=5)
+    args = parser.parse_args()
+    messages = args.users * args.steps
+
+    elapsed = await simulate(MemoryStorage(), args.users, args.steps)
+    print(f"MemoryStorage   {elapsed / messages * 1e6:8.2f} µs/message")
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'fsm.db')
+        storage = SQLiteStorage(path)
+        elapsed = await simulate(storage, args.users, args.steps)
+        started = time.perf_counter()
+        await storage.close()
+        flushed = time.perf_counter() - started
+        print(f"SQLiteStorage   {elapsed / messages * 1e6:8.2f} µs/message, final flush {flushed * 1000:.1f} ms")
+
+        # Холодный старт после перезапуска: все состояния подгружаются из базы
+        storage = SQLiteStorage(path)
+        elapsed = await simulate(storage, args.users, 1)
+        await storage.close()
+        print(f"SQLiteStorage   {elapsed / args.users * 1e6:8.2f} µs/message after restart (read-through)")
+
+if __name__ == '__main__':
+    asyncio.run(main())
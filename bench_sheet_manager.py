@@ -0,0 +1,109 @@
+"""Замеры SheetManager на локальной копии Google Sheets (fake_sheets).
+
+Запуск: python bench_sheet_manager.py --sizes 10000 100000 1000000 --latency 0.05
+Для каждого размера лист Users и лист Requests заполняются N строками, после чего
+замеряются get_data, query, batch_update + flush, add_new_entry и перечитывание листа.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import tempfile
+import time
+
+os.environ.setdefault('ADMIN_ID_1', '0')
+os.environ.setdefault('ADMIN_ID_2', '0')
+os.environ.setdefault('WRITE_AHEAD_LOG_PATH', os.path.join(tempfile.gettempdir(), 'bench_sheets_wal.jsonl'))
+
+from config import (
+    SHEET_HEADERS, USERS_SHEET, REQUESTS_SHEET, RATES_SHEET, ANALYTICS_SHEET,
+    UserFields, RequestFields, RequestStatus
+)
+from fake_sheets import FakeClient
+from sheet_manager import SheetManager
+from storage import SheetsBackend
+
+STATUSES = [RequestStatus.CHECK, RequestStatus.RUN, RequestStatus.DONE, RequestStatus.CANCEL]
+
+def build_sheets(size, seed=0):
+    rng = random.Random(seed)
+    users = [SHEET_HEADERS[USERS_SHEET]]
+    for user_id in range(1, size + 1):
+        user = {UserFields.USER_ID: str(user_id), UserFields.USERNAME: f"user{user_id}", UserFields.USER_STATUS: 'active'}
+        users.append([user.get(field, '') for field in SHEET_HEADERS[USERS_SHEET]])
+    requests = [SHEET_HEADERS[REQUESTS_SHEET]]
+    for request_id in range(1, size + 1):
+        request = {
+            RequestFields.REQUEST_ID: str(request_id),
+            RequestFields.USER_ID: str(rng.randint(1, size)),
+            RequestFields.SOURCE_CURRENCY: 'USDT',
+            RequestFields.TARGET_CURRENCY: 'RUB',
+            RequestFields.AMOUNT: str(rng.randint(100, 10000)),
+            RequestFields.STATUS: rng.choice(STATUSES),
+        }
+        requests.append([request.get(field, '') for field in SHEET_HEADERS[REQUESTS_SHEET]])
+    return {
+        USERS_SHEET: users,
+        REQUESTS_SHEET: requests,
+        RATES_SHEET: [SHEET_HEADERS[RATES_SHEET], ['USDT', 'RUB', '95', '100', '', '']],
+        ANALYTICS_SHEET: [SHEET_HEADERS[ANALYTICS_SHEET]],
+    }
+
+async def timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await func()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+def report(name, samples):
+    samples = sorted(samples)
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f"  {name:<28} n={len(samples):<6} median={statistics.median(samples) * 1000:9.3f} ms  p95={p95 * 1000:9.3f} ms")
+
+async def run(size, latency, repeat):
+    client = FakeClient(build_sheets(size), latency=latency)
+    print(f"{size} users / {size} requests, latency {latency * 1000:.0f} ms per call")
+
+    started = time.perf_counter()
+    manager = SheetManager('bench', backend=SheetsBackend('bench', client=client))
+    report('initial load', [time.perf_counter() - started])
+
+    rng = random.Random(1)
+    ids = [str(rng.randint(1, size)) for _ in range(repeat)]
+    next_id = iter(ids)
+    report('get_data by id', await timed(lambda: manager.get_data(USERS_SHEET, next(next_id)), repeat))
+    report('query by status', await timed(
+        lambda: manager.query(REQUESTS_SHEET, {RequestFields.STATUS: RequestStatus.CHECK}), max(1, repeat // 100)))
+
+    next_id = iter(ids)
+    report('batch_update (queue)', await timed(
+        lambda: manager.batch_update(REQUESTS_SHEET, next(next_id), {RequestFields.STATUS: RequestStatus.DONE}), repeat))
+    report('flush', await timed(manager.flush, 1))
+
+    new_ids = iter(range(size + 1, size + repeat + 1))
+    report('add_new_entry', await timed(
+        lambda: manager.add_new_entry(REQUESTS_SHEET, {RequestFields.REQUEST_ID: str(next(new_ids)), RequestFields.STATUS: RequestStatus.CHECK}),
+        repeat))
+    report('flush', await timed(manager.flush, 1))
+
+    report('cache refresh', await timed(lambda: manager._reload_sheet(REQUESTS_SHEET), 3))
+
+    await manager.close()
+    print(f"  API calls: {dict(client.stats)}")
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--latency', type=float, default=0.0, help='задержка каждого вызова API, секунды')
+    parser.add_argument('--repeat', type=int, default=1000, help='число операций в каждом замере')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+    for size in args.sizes:
+        await run(size, args.latency, args.repeat)
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,46 @@
+import logging
+import os
+import pickle
+
+logger = logging.getLogger(__name__)
+
+class CacheSnapshot:
+    """Снимок кэша SheetManager на диске для быстрого старта без Google Sheets.
+
+    Снимок — один файл pickle: для каждого листа заголовки, строки кэша и
+    номера строк на листе. Файл пишется во временный и атомарно подменяется,
+    поэтому при падении во время записи остается предыдущий снимок.
+    """
+
+    FORMAT_VERSION = 2
+
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+
+    def dumps(self, sheets, saved_at):
+        # Сериализуем сразу, в цикле событий, чтобы в файл попало согласованное состояние
+        state = {'format': self.FORMAT_VERSION, 'saved_at': saved_at, 'sheets': sheets}
+        return pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def write(self, data):
+        with open(self.tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.tmp_path, self.path)
+
+    def load(self):
+        """Возвращает сохраненное состояние или None, если снимка нет или он не читается."""
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, 'rb') as f:
+                state = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable cache snapshot {self.path}: {e}")
+            return None
+        if not isinstance(state, dict) or state.get('format') != self.FORMAT_VERSION:
+            logger.warning(f"Ignoring cache snapshot {self.path} in unsupported format")
+            return None
+        return state
@@ -2,7 +2,7 @@
 import os
 import base64
 import json
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 from google.oauth2.service_account import Credentials
 
@@ -15,6 +15,12 @@ ADMIN_IDS = [os.getenv('ADMIN_ID_1'), os.getenv('ADMIN_ID_2')]
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 G_SHEET_ID = os.getenv('G_SHEET_ID')
 
+# Режим вебхука: если задан WEBHOOK_URL (например, https://bot.example.com), Telegram
+# присылает обновления на aiohttp-сервер бота вместо long polling
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+
 # Получаем JSON-строку из переменной окружения
 g_sheet_cred_json = os.getenv('G_SHEET_CRED_JSON')
 
@@ -28,13 +34,93 @@ else:
 
 # Параметры кэширования
 CACHE_TTL = timedelta(minutes=10)
-CACHE_UPDATE_INTERVAL = timedelta(hours=1)
+CACHE_UPDATE_INTERVAL = timedelta(hours=1)  # Максимальная пауза фонового обновления кэша
+CACHE_RETRY_INTERVAL = timedelta(seconds=30)  # Повтор обновления после ошибки Google Sheets
+
+# Снимок кэша на диске: с ним бот стартует без Google Sheets и сверяется с таблицей в фоне.
+# Пустой путь — не сохранять снимки
+CACHE_SNAPSHOT_PATH = os.getenv('CACHE_SNAPSHOT_PATH', 'sheets_cache.snapshot')
+CACHE_SNAPSHOT_INTERVAL = timedelta(minutes=1)
+
+# Размер пула потоков для блокирующих запросов к Google Sheets
+SHEETS_MAX_WORKERS = int(os.getenv('SHEETS_MAX_WORKERS', 4))
+
+# Квоты Sheets API (запросов в минуту) и повторы при ошибках 429/5xx
+SHEETS_READ_QUOTA_PER_MINUTE = int(os.getenv('SHEETS_READ_QUOTA_PER_MINUTE', 60))
+SHEETS_WRITE_QUOTA_PER_MINUTE = int(os.getenv('SHEETS_WRITE_QUOTA_PER_MINUTE', 60))
+SHEETS_MAX_RETRIES = 5
+SHEETS_BACKOFF_BASE = 1  # секунды
+SHEETS_BACKOFF_MAX = 32  # секунды
+
+# Основное хранилище: 'sheets' — Google Sheets, 'sqlite' — локальная база,
+# для которой Google Sheets служит зеркалом (если задан G_SHEET_ID)
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'sheets')
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'goldantilop.db')
+SHEETS_MIRROR_ENABLED = os.getenv('SHEETS_MIRROR_ENABLED', '1') == '1'
+# Как часто сверять локальную базу с зеркалом: независимо от времени жизни кэша,
+# чтобы новые заявки попадали в таблицу, а правки администраторов — в бота без задержки в часы
+MIRROR_SYNC_INTERVAL = timedelta(minutes=1)
+
+# Отложенная запись в Google Sheets через локальный журнал изменений
+WRITE_AHEAD_LOG_PATH = os.getenv('WRITE_AHEAD_LOG_PATH', 'sheets_wal.jsonl')
+WRITE_BEHIND_INTERVAL = timedelta(seconds=5)
+
+# Состояния FSM пользователей хранятся в SQLite, чтобы переживать перезапуск бота.
+# Пустой путь — хранить только в памяти, как раньше
+FSM_STORAGE_PATH = os.getenv('FSM_STORAGE_PATH', 'fsm_states.db')
+FSM_FLUSH_INTERVAL = timedelta(seconds=1)
+
+# Уведомления администраторам: кэш списка получателей и параллельность
+NOTIFY_ADMINS_TTL = timedelta(minutes=5)
+NOTIFY_CONCURRENCY = int(os.getenv('NOTIFY_CONCURRENCY', 10))
+
+# Число заявок на одной странице списка
+REQUESTS_PAGE_SIZE = 5
+
+# Отчет о выполненных заявках: длина одного сообщения и сколько сообщений
+# отправлять, прежде чем прислать отчет файлом
+REPORT_MESSAGE_LIMIT = 4000
+REPORT_MAX_MESSAGES = 5
+
+# Сколько периодов показывают /daily и /weekly по умолчанию и максимум
+ROLLUP_DEFAULT_PERIODS = {'day': 7, 'week': 4}
+ROLLUP_MAX_PERIODS = 90
+
+# Номера заявок: отсчет времени и символ процесса бота. Если ботов несколько,
+# каждому обязательно нужен свой REQUEST_ID_NODE (символ base32 Крокфорда);
+# без него символ выводится из имени хоста и может совпасть у двух ботов
+REQUEST_ID_EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+REQUEST_ID_NODE = os.getenv('REQUEST_ID_NODE', '').upper()
+
+# Лимиты Telegram на исходящие сообщения (в секунду) и повторы после 429
+TELEGRAM_GLOBAL_RATE = 30
+TELEGRAM_GLOBAL_BURST = 30
+TELEGRAM_CHAT_RATE = 1
+TELEGRAM_CHAT_BURST = 3
+TELEGRAM_MAX_RETRIES = 3
 
 # Названия листов в Google Sheets
 USERS_SHEET = 'Users'
 RATES_SHEET = 'Rates'
 REQUESTS_SHEET = 'Requests'
 ANALYTICS_SHEET = 'Analytics'
+REQUESTS_ARCHIVE_SHEET = 'RequestsArchive'  # Не кэшируется, читается по запросу
+
+# Архив заявок: выполненные и отмененные заявки старше ARCHIVE_AFTER раз в ARCHIVE_INTERVAL
+# переносятся с листа Requests на лист архива. 0 дней — сразу после завершения заявки,
+# на листе Requests остаются только активные. Прочитанный целиком архив держится в памяти ARCHIVE_CACHE_TTL
+ARCHIVE_ENABLED = os.getenv('ARCHIVE_ENABLED', '1') == '1'
+ARCHIVE_AFTER = timedelta(days=int(os.getenv('ARCHIVE_AFTER_DAYS', 30)))
+ARCHIVE_INTERVAL = timedelta(hours=6)
+ARCHIVE_CACHE_TTL = timedelta(minutes=10)
+
+# Время жизни кэша по листам: курсы меняются часто, пользователи редко,
+# а заявки бот сам поддерживает в актуальном виде при каждой записи
+CACHE_TTLS = {
+    RATES_SHEET: timedelta(minutes=2),
+    USERS_SHEET: timedelta(hours=1),
+    REQUESTS_SHEET: timedelta(hours=6),
+}
 
 # Статусы пользователей и заявок
 class UserStatus:
@@ -115,6 +201,18 @@ class AnalyticsFields:
     VALUE = 'VALUE'
     LAST_UPDATED = 'LAST_UPDATED'
 
+def _field_names(fields_class):
+    return [value for name, value in vars(fields_class).items() if not name.startswith('_')]
+
+# Заголовки листов для локальной базы, если их не из чего взять
+SHEET_HEADERS = {
+    USERS_SHEET: _field_names(UserFields),
+    RATES_SHEET: _field_names(RateFields),
+    REQUESTS_SHEET: _field_names(RequestFields),
+    ANALYTICS_SHEET: _field_names(AnalyticsFields),
+    REQUESTS_ARCHIVE_SHEET: _field_names(RequestFields),
+}
+
 # Локализация сообщений и текстов интерфейса
 class Messages:
     # 🌀 Общие сообщения
@@ -175,6 +273,7 @@ class Messages:
     # Форма заявки
     REQUEST_FORMAT = "🆔: {request_id}\n📆: {date} – {status_text}\n💰 {amount} {source_currency} ➡️ {result} {target_currency}"
     ADMIN_REQUEST_FORMAT = "👤 @{username}\n" + REQUEST_FORMAT
+    REQUESTS_PAGE_HEADER = "📋 Заявки {first}–{last} из {total}\n\n"  # Заголовок страницы списка заявок
 
     # Сообщения для заявок
     NO_REQUESTS = "💤 Всё чисто. Никаких заявок."  # Когда у пользователя нет активных заявок
@@ -197,6 +296,7 @@ class Messages:
     ADMIN_REQUEST_COMPLETED = "Заявка отменена, пользователь в курсе."  # Подтверждение завершения заявки
     NO_COMPLETED_REQUESTS = "Нет выполненных заявок." # Когда у админа нет завершенных заявок
     COMPLETED_REQUESTS_HEADER = "Выполненные заявки:\n\n" # Заголовок для списка завершенных заявок
+    COMPLETED_REQUESTS_USAGE = "Формат: /completed [с ДД.ММ.ГГ] [по ДД.ММ.ГГ] [пара, например USDT-RUB]" # Подсказка при неверных фильтрах отчета
     WRITE_TO_ADMIN_PROMPT = "О чем ты хотел поведать? Пиши:" # Когда можно написать сообщение для Антилопы в меню Помощь
 
     # Сообщения для функции show_friends
@@ -211,6 +311,14 @@ class Messages:
     AVERAGE_EXCHANGE_VOLUME = "Средний объем обмена: {average_volume:,}\n"  # Средний объем обмена
     MOST_POPULAR_PAIR = "Самая популярная валютная пара: {pair}\n"  # Самая популярная валютная пара
     NO_DATA = "Нет данных"  # Сообщение при отсутствии данных
+    ROLLUP_HEADERS = {'day': "📅 Обмены по дням:\n", 'week': "📅 Обмены по неделям:\n"}  # Заголовки сводок по периодам
+    ROLLUP_PERIOD = "\n*{period}*\n"  # Начало периода в сводке
+    ROLLUP_PAIR = "{source} -> {target}: {count} шт., объем {volume:,}, медиана {median:,}, p95 {p95:,}\n"  # Строка пары в сводке
+    ROLLUP_USAGE = "Формат: /daily [число дней] или /weekly [число недель]"  # Подсказка при неверном аргументе
+    REQUEST_LOOKUP_USAGE = "Формат: /request номер заявки"  # Подсказка для поиска заявки
+    REQUEST_NOT_FOUND = "Заявка {request_id} не найдена ни среди текущих, ни в архиве"  # Заявки нет ни на листе, ни в архиве
+    SCHEMA_UNCHANGED = "Колонки листов не изменились"  # Ответ на /schema без изменений
+    SCHEMA_UPDATED = "Колонки обновлены на листах: {sheets}"  # Ответ на /schema после перечитывания заголовков
 
     # Сообщения Антилопе из меню Помощь
     UNKNOWN_USER = "Неизвестный пользователь."  # При отправке сообщения от неизвестного пользователя
@@ -251,6 +359,8 @@ class ButtonTexts:
     ACCEPT_REQUEST = "✅ Принять"
     REJECT_REQUEST = "❌ Отклонить"
     COMPLETE_REQUEST = "🏁 Завершить"
+    PREV_PAGE = "◀️"
+    NEXT_PAGE = "▶️"
     CANCEL = "✋ Отмена"
     BACK_TO_MENU = "🔙 Обратно в меню"
     WRITE_TO_ADMIN = "✍️ Написать Антилопе"
@@ -2,46 +2,37 @@ import logging
 from typing import Union
 from aiogram import Router, F
 from aiogram.types import CallbackQuery, Message
-from aiogram.utils.keyboard import InlineKeyboardBuilder
 from aiogram.fsm.context import FSMContext
 from states import ExchangeStates
 import math
 from datetime import datetime
-import uuid
-from config import RATES_SHEET, REQUESTS_SHEET, USERS_SHEET, ButtonTexts, Messages, RateFields, RequestFields, RequestStatus, UserFields, UserStatus
+from config import REQUEST_ID_NODE, REQUESTS_SHEET, USERS_SHEET, ButtonTexts, Messages, RequestFields, RequestStatus, UserFields
+from rates_index import get_rates_index
+from request_ids import RequestIdAllocator
 from uiux import UIUX
 
 exchange_router = Router()
 
 __all__ = ['exchange_router', 'setup_exchange_router']
 
-def generate_request_id():
-    current_time = datetime.now()
-    milliseconds = current_time.microsecond // 1000
-    ms_chars = f"{milliseconds:03d}"[:2]
-    random_char = uuid.uuid4().hex[0]
-    last_char = uuid.uuid4().hex[0]
-    return f"{ms_chars}{random_char}{last_char}".upper()
+request_ids = RequestIdAllocator(REQUEST_ID_NODE)
+
+def generate_request_id(taken=()):
+    return request_ids.next_id(taken)
 
 @exchange_router.message(F.text == ButtonTexts.CALCULATE_EXCHANGE)
 @exchange_router.callback_query(F.data == "recalculate")
 async def start_exchange(message: Union[Message, CallbackQuery], state: FSMContext):
     await state.clear()
-    sheet_manager = exchange_router.sheet_manager
-    source_currencies = get_source_currencies(sheet_manager)
-    
-    kb = InlineKeyboardBuilder()
-    for currency in source_currencies:
-        kb.button(text=currency, callback_data=f"source_{currency}")
-    kb.adjust(3)
+    rates = await get_rates_index(exchange_router.sheet_manager)
     
     text = Messages.CHOOSE_SOURCE_CURRENCY
     
     if isinstance(message, CallbackQuery):
         await message.answer()
-        await message.message.edit_text(text, reply_markup=kb.as_markup())
+        await message.message.edit_text(text, reply_markup=rates.source_keyboard)
     else:
-        await message.answer(text, reply_markup=kb.as_markup())
+        await message.answer(text, reply_markup=rates.source_keyboard)
     
     await state.set_state(ExchangeStates.choosing_source)
 
@@ -78,16 +69,11 @@ async def process_source_currency(callback: CallbackQuery, state: FSMContext):
     source_currency = callback.data.split('_')[1]
     await state.update_data(SELECTED_SOURCE_CURRENCY=source_currency)
     
-    target_currencies = get_target_currencies(exchange_router.sheet_manager, source_currency)
-    
-    kb = InlineKeyboardBuilder()
-    for currency in target_currencies:
-        kb.button(text=currency, callback_data=f"target_{currency}")
-    kb.adjust(3)
+    rates = await get_rates_index(exchange_router.sheet_manager)
     
     await callback.message.edit_text(
         Messages.SOURCE_AND_TARGET_CURRENCY.format(source_currency=source_currency),
-        reply_markup=kb.as_markup()
+        reply_markup=rates.target_keyboard(source_currency)
     )
     await state.set_state(ExchangeStates.choosing_target)
 
@@ -102,14 +88,14 @@ async def process_target_currency(callback: CallbackQuery, state: FSMContext):
 
     await state.update_data(SELECTED_TARGET_CURRENCY=target_currency)
 
-    exchange_info = get_exchange_info(exchange_router.sheet_manager, source_currency, target_currency)
+    rates = await get_rates_index(exchange_router.sheet_manager)
+    exchange_info = rates.pairs.get((source_currency, target_currency))
     if not exchange_info:
         await callback.message.edit_text(Messages.EXCHANGE_RATE_NOT_FOUND.format(source_currency=source_currency, target_currency=target_currency))
         await state.clear()
         return
 
-    exchange_rate = float(exchange_info[RateFields.RATE])
-    min_amount = float(exchange_info[RateFields.MIN_AMOUNT].replace(',', ''))
+    exchange_rate, min_amount = exchange_info
     await state.update_data(exchange_rate=exchange_rate, min_amount=min_amount)
 
     await callback.message.edit_text(
@@ -165,13 +151,11 @@ async def confirm_exchange(callback: CallbackQuery, state: FSMContext):
         sheet_manager = exchange_router.sheet_manager
         
         user_id = str(callback.from_user.id)
-        user_info = sheet_manager.get_data(USERS_SHEET, user_id)
+        user_info = await sheet_manager.get_data(USERS_SHEET, user_id)
         username = user_info.get(UserFields.USERNAME, Messages.UNKNOWN_USER)
         
-        request_id = generate_request_id()
+        request_id = generate_request_id(await sheet_manager.ids(REQUESTS_SHEET))
         logging.info(f"Generated REQUEST_ID: {request_id}")
-        while sheet_manager.get_data(REQUESTS_SHEET, request_id):
-            request_id = generate_request_id()
         
         new_request = {
             RequestFields.REQUEST_ID: request_id,
@@ -187,7 +171,7 @@ async def confirm_exchange(callback: CallbackQuery, state: FSMContext):
         }
         
         logging.info(f"Attempting to create new request: {new_request}")
-        sheet_manager.add_new_entry(REQUESTS_SHEET, new_request)
+        await sheet_manager.add_new_entry(REQUESTS_SHEET, new_request)
         logging.info("New request created successfully")
         
         await callback.message.edit_text(
@@ -199,7 +183,7 @@ async def confirm_exchange(callback: CallbackQuery, state: FSMContext):
         
         admin_message = UIUX.format_request(new_request, is_admin=True)
         admin_keyboard = UIUX.admin_request_actions(new_request[RequestFields.REQUEST_ID], new_request[RequestFields.STATUS])
-        await notify_admin(callback.bot, sheet_manager, admin_message, admin_keyboard)
+        exchange_router.notifier.notify_admins(admin_message, reply_markup=admin_keyboard)
         
         await state.update_data(request_created=True)
         await state.clear()
@@ -215,23 +199,6 @@ async def recalculate_exchange(callback: CallbackQuery, state: FSMContext):
     await callback.message.edit_reply_markup(reply_markup=None)
     await start_exchange(callback, state)
 
-def get_source_currencies(sheet_manager):
-    rates = sheet_manager.get_data(RATES_SHEET)
-    return list(set(rate[RateFields.SOURCE_CURRENCY] for rate in rates))
-
-def get_target_currencies(sheet_manager, source_currency):
-    rates = sheet_manager.get_data(RATES_SHEET)
-    return list(set(rate[RateFields.TARGET_CURRENCY] for rate in rates if rate[RateFields.SOURCE_CURRENCY] == source_currency))
-
-def get_exchange_info(sheet_manager, source_currency, target_currency):
-    rates = sheet_manager.get_data(RATES_SHEET)
-    return next((rate for rate in rates if rate[RateFields.SOURCE_CURRENCY] == source_currency and rate[RateFields.TARGET_CURRENCY] == target_currency), None)
-
-async def notify_admin(bot, sheet_manager, message, keyboard=None):
-    admin_users = [user for user in sheet_manager.get_data(USERS_SHEET) if user[UserFields.USER_STATUS] == UserStatus.ADMIN]
-    for admin in admin_users:
-        await bot.send_message(chat_id=admin[UserFields.USER_ID], text=message, reply_markup=keyboard)
-
 def setup_exchange_router(return_to_main_menu_func, show_exchange_rates_func, show_help_func, show_user_requests_func, start_exchange_func=None):
     global return_to_main_menu, show_exchange_rates, show_help, show_user_requests, start_exchange
     return_to_main_menu = return_to_main_menu_func
@@ -0,0 +1,187 @@
+import threading
+import time
+from collections import Counter, deque
+
+import gspread
+from gspread.exceptions import APIError, WorksheetNotFound
+
+# Локальная замена Google Sheets для замеров и запуска бота без сети.
+# Повторяет ту часть API gspread (Client/Spreadsheet/Worksheet), которой пользуется
+# SheetsBackend, и позволяет добавить задержку каждого вызова и ошибки квоты.
+
+class _FakeResponse:
+    def __init__(self, code, message):
+        self.status_code = code
+        self.text = message
+        self._json = {'error': {'code': code, 'message': message, 'status': 'RESOURCE_EXHAUSTED'}}
+
+    def json(self):
+        return self._json
+
+class FakeClient:
+    """Аналог gspread.Client: `FakeClient({'Users': [[заголовки], [строка], ...]})`."""
+
+    def __init__(self, sheets, latency=0.0, quota_per_minute=None):
+        self.latency = latency
+        self.quota_per_minute = quota_per_minute
+        self.stats = Counter()
+        self.http_client = self
+        self._calls = deque()
+        self._fail_next = 0
+        self._lock = threading.Lock()
+        self.spreadsheet = FakeSpreadsheet(self, sheets)
+
+    def open_by_key(self, key):
+        return self.spreadsheet
+
+    def fail_next(self, count=1):
+        """Следующие `count` вызовов завершатся ошибкой 429."""
+        with self._lock:
+            self._fail_next += count
+
+    def _request(self, operation):
+        with self._lock:
+            self.stats[operation] += 1
+            now = time.monotonic()
+            while self._calls and now - self._calls[0] > 60:
+                self._calls.popleft()
+            self._calls.append(now)
+            over_quota = self.quota_per_minute is not None and len(self._calls) > self.quota_per_minute
+            fail = self._fail_next > 0
+            if fail:
+                self._fail_next -= 1
+        if self.latency:
+            time.sleep(self.latency)
+        if fail or over_quota:
+            self.stats['errors'] += 1
+            raise APIError(_FakeResponse(429, 'Quota exceeded'))
+
+class FakeSpreadsheet:
+    def __init__(self, client, sheets):
+        self.client = client
+        self._worksheets = [FakeWorksheet(client, title, rows, sheet_id) for sheet_id, (title, rows) in enumerate(sheets.items())]
+
+    def worksheets(self):
+        self.client._request('worksheets')
+        return list(self._worksheets)
+
+    def values_batch_get(self, ranges, params=None):
+        self.client._request('values_batch_get')
+        by_columns = (params or {}).get('majorDimension') == 'COLUMNS'
+        value_ranges = []
+        for range_name in ranges:
+            title, _, cells = range_name.rpartition('!')
+            worksheet = self.worksheet(title.strip("'").replace("''", "'"))
+            grid = gspread.utils.a1_range_to_grid_range(cells)
+            with worksheet._lock:
+                rows = worksheet.rows[grid.get('startRowIndex', 0):grid.get('endRowIndex')]
+                values = [list(row[grid.get('startColumnIndex', 0):grid.get('endColumnIndex')]) for row in rows]
+            if by_columns:
+                width = max((len(row) for row in values), default=0)
+                values = [[row[col] if col < len(row) else '' for row in values] for col in range(width)]
+            # Как и Google, обрезаем пустые ячейки в конце строк и пустые строки в конце диапазона
+            for row in values:
+                while row and row[-1] == '':
+                    row.pop()
+            while values and not values[-1]:
+                values.pop()
+            value_range = {'range': range_name, 'majorDimension': 'COLUMNS' if by_columns else 'ROWS'}
+            if values:
+                value_range['values'] = values
+            value_ranges.append(value_range)
+        return {'valueRanges': value_ranges}
+
+    def add_worksheet(self, title, rows, cols, index=None):
+        self.client._request('add_worksheet')
+        worksheet = FakeWorksheet(self.client, title, [], len(self._worksheets))
+        self._worksheets.append(worksheet)
+        return worksheet
+
+    def batch_update(self, body):
+        self.client._request('batch_update')
+        worksheets = {worksheet.id: worksheet for worksheet in self._worksheets}
+        for request in body['requests']:
+            # Поддерживается только удаление строк — единственное, что делает SheetsBackend
+            dimension_range = request['deleteDimension']['range']
+            worksheet = worksheets[dimension_range['sheetId']]
+            with worksheet._lock:
+                del worksheet.rows[dimension_range['startIndex']:dimension_range['endIndex']]
+        return {'replies': [{} for _ in body['requests']]}
+
+    def worksheet(self, title):
+        for worksheet in self._worksheets:
+            if worksheet.title == title:
+                return worksheet
+        raise WorksheetNotFound(title)
+
+class FakeWorksheet:
+    def __init__(self, client, title, rows, sheet_id=0):
+        self.client = client
+        self.title = title
+        self.id = sheet_id
+        self.rows = [list(row) for row in rows]
+        self._lock = threading.Lock()
+
+    @property
+    def col_count(self):
+        return self._width()
+
+    def _width(self):
+        return max((len(row) for row in self.rows), default=0)
+
+    def row_values(self, row):
+        self.client._request('row_values')
+        with self._lock:
+            values = list(self.rows[row - 1]) if row <= len(self.rows) else []
+        # Как и Google, не возвращаем пустые ячейки в конце строки
+        while values and values[-1] == '':
+            values.pop()
+        return values
+
+    def get_all_values(self):
+        self.client._request('get_all_values')
+        with self._lock:
+            width = self._width()
+            return [list(row) + [''] * (width - len(row)) for row in self.rows]
+
+    def find(self, query, in_row=None, in_column=None, case_sensitive=True):
+        self.client._request('find')
+        with self._lock:
+            for row_number, row in enumerate(self.rows, start=1):
+                if in_row is not None and row_number != in_row:
+                    continue
+                for col, value in enumerate(row, start=1):
+                    if in_column is not None and col != in_column:
+                        continue
+                    if value == query if case_sensitive else value.lower() == query.lower():
+                        return gspread.Cell(row_number, col, value)
+        return None
+
+    def update_cells(self, cells, value_input_option=None):
+        self.client._request('update_cells')
+        with self._lock:
+            for cell in cells:
+                while len(self.rows) < cell.row:
+                    self.rows.append([])
+                row = self.rows[cell.row - 1]
+                if len(row) < cell.col:
+                    row.extend([''] * (cell.col - len(row)))
+                row[cell.col - 1] = str(cell.value)
+        return {'updatedCells': len(cells)}
+
+    def _append(self, values):
+        with self._lock:
+            first_row = len(self.rows) + 1
+            self.rows.extend([str(value) for value in row] for row in values)
+            last_row = len(self.rows)
+        width = max((len(row) for row in values), default=1)
+        end = gspread.utils.rowcol_to_a1(last_row, max(width, 1))
+        return {'updates': {'updatedRange': f"{self.title}!A{first_row}:{end}", 'updatedRows': len(values)}}
+
+    def append_row(self, values, value_input_option=None, **kwargs):
+        self.client._request('append_row')
+        return self._append([values])
+
+    def append_rows(self, values, value_input_option=None, **kwargs):
+        self.client._request('append_rows')
+        return self._append(values)
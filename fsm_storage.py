@@ -0,0 +1,114 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+from contextlib import suppress
+from copy import copy
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder
+
+from config import FSM_FLUSH_INTERVAL
+
+logger = logging.getLogger(__name__)
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище aiogram, переживающее перезапуск бота.
+
+    Чтение идет из словаря в памяти; при промахе запись один раз подгружается
+    из SQLite по первичному ключу. Изменения помечают ключ как грязный и раз в
+    FSM_FLUSH_INTERVAL записываются в базу одной транзакцией, поэтому несколько
+    изменений одного пользователя между сбросами превращаются в одну запись.
+    """
+
+    def __init__(self, path, key_builder=None):
+        self.path = path
+        self.key_builder = key_builder or DefaultKeyBuilder(with_bot_id=True, with_destiny=True)
+        self.records = {}  # ключ -> (состояние, данные)
+        self._dirty = {}  # ключи, измененные с последнего сброса (упорядоченное множество)
+        self._lock = threading.Lock()
+        self._flush_lock = asyncio.Lock()
+        self._flusher_task = None
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS fsm (key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL)')
+
+    def _record(self, key):
+        storage_key = self.key_builder.build(key)
+        record = self.records.get(storage_key)
+        if record is None:
+            with self._lock:
+                row = self.conn.execute('SELECT state, data FROM fsm WHERE key = ?', (storage_key,)).fetchone()
+            record = (row[0], json.loads(row[1])) if row else (None, {})
+            self.records[storage_key] = record
+        return storage_key, record
+
+    def _put(self, storage_key, state, data):
+        self.records[storage_key] = (state, data)
+        self._dirty[storage_key] = None
+        if self._flusher_task is None:
+            self._flusher_task = asyncio.create_task(self._flusher_loop())
+
+    async def set_state(self, key, state=None):
+        storage_key, (_, data) = self._record(key)
+        self._put(storage_key, state.state if isinstance(state, State) else state, data)
+
+    async def get_state(self, key):
+        return self._record(key)[1][0]
+
+    async def set_data(self, key, data):
+        storage_key, (state, _) = self._record(key)
+        self._put(storage_key, state, data.copy())
+
+    async def get_data(self, key):
+        return self._record(key)[1][1].copy()
+
+    async def get_value(self, storage_key, dict_key, default=None):
+        return copy(self._record(storage_key)[1][1].get(dict_key, default))
+
+    async def _flusher_loop(self):
+        while True:
+            await asyncio.sleep(FSM_FLUSH_INTERVAL.total_seconds())
+            await self.flush()
+
+    async def flush(self):
+        async with self._flush_lock:
+            if not self._dirty:
+                return
+            batch = {key: self.records[key] for key in self._dirty}
+            self._dirty = {}
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self._write, batch)
+            except Exception as e:
+                logger.error(f"Failed to save FSM states, will retry: {e}")
+                # Более свежие изменения тех же ключей не затираем
+                for key in batch:
+                    self._dirty.setdefault(key, None)
+
+    def _write(self, batch):
+        upserts = []
+        deletes = []
+        for key, (state, data) in batch.items():
+            if state is None and not data:
+                deletes.append((key,))
+            else:
+                upserts.append((key, state, json.dumps(data, ensure_ascii=False)))
+        with self._lock, self.conn:
+            self.conn.executemany(
+                'INSERT INTO fsm (key, state, data) VALUES (?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data',
+                upserts
+            )
+            self.conn.executemany('DELETE FROM fsm WHERE key = ?', deletes)
+
+    async def close(self):
+        if self._flusher_task:
+            self._flusher_task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._flusher_task
+            self._flusher_task = None
+        await self.flush()
+        with self._lock:
+            self.conn.close()
@@ -1,6 +1,8 @@
 import asyncio
 import logging
 import os
+import secrets
+import signal
 import sys
 from contextlib import suppress
 
@@ -11,11 +13,18 @@ from aiogram.enums import ParseMode
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.filters import Command
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
 
 from config import (
-    ADMIN_IDS, BOT_TOKEN, G_SHEET_ID, USERS_SHEET, 
+    ADMIN_IDS, BOT_TOKEN, FSM_STORAGE_PATH, G_SHEET_ID, USERS_SHEET,
+    WEBHOOK_PATH, WEBHOOK_SECRET, WEBHOOK_URL,
     ButtonTexts, Messages, UserFields, UserState, UserStatus
 )
+from fsm_storage import SQLiteStorage
+from analytics import AnalyticsEngine
+from notifications import AdminNotifier
+from outbound import OutboundScheduler
+from request_archive import RequestArchive
 from sheet_manager import SheetManager
 from onboarding import onboarding_router, start_onboarding
 from user import main_menu, user_router, return_to_main_menu, show_exchange_rates, show_help, show_user_requests
@@ -49,7 +58,9 @@ class BotApp:
             token=BOT_TOKEN, 
             default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN)
         )
-        self.storage = MemoryStorage()
+        self.outbound = OutboundScheduler()
+        self.bot.session.middleware(self.outbound)
+        self.storage = SQLiteStorage(FSM_STORAGE_PATH) if FSM_STORAGE_PATH else MemoryStorage()
         self.dp = Dispatcher(storage=self.storage)
         self.main_router = Router()
         
@@ -58,6 +69,9 @@ class BotApp:
         except Exception as e:
             logger.error(f"Failed to initialize SheetManager: {e}")
             sys.exit(1)
+        self.notifier = AdminNotifier(self.bot, self.sheet_manager)
+        self.archive = RequestArchive(self.sheet_manager)
+        self.analytics = AnalyticsEngine(self.sheet_manager, self.archive)
 
     async def start(self):
         self.dp.include_router(error_router)
@@ -70,6 +84,9 @@ class BotApp:
         for router in [onboarding_router, user_router, admin_router, exchange_router]:
             router.sheet_manager = self.sheet_manager
             router.bot = self.bot
+            router.notifier = self.notifier
+            router.analytics = self.analytics
+            router.archive = self.archive
 
         setup_exchange_router(
             return_to_main_menu, 
@@ -80,6 +97,9 @@ class BotApp:
 
         setup_global_error_handler(self.dp)
 
+        self.sheet_manager.start()
+        self.archive.start()
+
         self.setup_routes()
         logger.info("Bot started")
 
@@ -115,7 +135,7 @@ class BotApp:
             return
 
         try:
-            user_data = self.sheet_manager.get_data(USERS_SHEET, user_id)
+            user_data = await self.sheet_manager.get_data(USERS_SHEET, user_id)
             logger.info(f"User data for {user_id}: {user_data}")
 
             if not user_data:
@@ -127,15 +147,12 @@ class BotApp:
                         UserFields.USER_STATE: UserState.ADMIN_MENU
                     }
                     logger.info(f"Attempting to add new admin: {new_admin_data}")
-                    self.sheet_manager.add_new_entry(USERS_SHEET, new_admin_data)
+                    await self.sheet_manager.add_new_entry(USERS_SHEET, new_admin_data)
+                    self.notifier.invalidate()
                     await message.answer(Messages.ADMIN_WELCOME, reply_markup=UIUX.admin_menu())
                 else:
-                    all_users = self.sheet_manager.get_data(USERS_SHEET)
-                    logger.info(f"All users: {all_users}")
-                    admin_exists = any(
-                        user.get(UserFields.USER_STATUS) == UserStatus.ADMIN 
-                        for user in all_users if isinstance(user, dict)
-                    )
+                    admin_users = await self.sheet_manager.query(USERS_SHEET, {UserFields.USER_STATUS: UserStatus.ADMIN})
+                    admin_exists = bool(admin_users)
                     if admin_exists:
                         new_user_data = {
                             UserFields.USER_ID: user_id,
@@ -143,7 +160,7 @@ class BotApp:
                             UserFields.USER_STATUS: UserStatus.PENDING,
                             UserFields.USER_STATE: UserState.WAITING_REFERRAL
                         }
-                        self.sheet_manager.add_new_entry(USERS_SHEET, new_user_data)
+                        await self.sheet_manager.add_new_entry(USERS_SHEET, new_user_data)
                         await message.answer(Messages.USER_WELCOME, reply_markup=types.ReplyKeyboardRemove())
                         await start_onboarding(message, state)
                     else:
@@ -160,7 +177,7 @@ class BotApp:
             logger.warning(f"User {user_id} has no USER_STATUS. Data: {user_data}")
             if str(user_id) in ADMIN_IDS:
                 user_status = UserStatus.ADMIN
-                self.sheet_manager.batch_update(
+                await self.sheet_manager.batch_update(
                     USERS_SHEET, 
                     user_id, 
                     {
@@ -168,9 +185,10 @@ class BotApp:
                         UserFields.USER_STATE: UserState.ADMIN_MENU
                     }
                 )
+                self.notifier.invalidate()
             else:
                 user_status = UserStatus.PENDING
-                self.sheet_manager.batch_update(
+                await self.sheet_manager.batch_update(
                     USERS_SHEET, 
                     user_id, 
                     {
@@ -197,6 +215,16 @@ async def main():
     # Настройка веб-сервера
     app = web.Application()
     app.router.add_get("/", handle)
+
+    if WEBHOOK_URL:
+        # Секрет из окружения или новый при каждом запуске: вебхук все равно
+        # переустанавливается ниже, а чужие запросы без него отклоняются
+        webhook_secret = WEBHOOK_SECRET or secrets.token_urlsafe(32)
+        SimpleRequestHandler(
+            dispatcher=bot_app.dp,
+            bot=bot_app.bot,
+            secret_token=webhook_secret
+        ).register(app, path=WEBHOOK_PATH)
     
     # Получение порта из окружения
     port = int(os.environ.get("PORT", 5000))
@@ -206,16 +234,39 @@ async def main():
     await runner.setup()
     site = web.TCPSite(runner, host='0.0.0.0', port=port)
     
-    await site.start()
-    
     try:
+        # Роутеры должны быть настроены до того, как сервер начнет принимать обновления
         await bot_app.start()
-        await bot_app.dp.start_polling(bot_app.bot)
+        await site.start()
+        if WEBHOOK_URL:
+            await bot_app.bot.set_webhook(
+                WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                secret_token=webhook_secret,
+                allowed_updates=bot_app.dp.resolve_used_update_types()
+            )
+            logger.info(f"Receiving updates via webhook on {WEBHOOK_PATH}")
+            # В режиме поллинга сигналы обрабатывает aiogram, здесь — сами, иначе при
+            # перезапуске процесса не выполнится finally и пропадут несохраненные изменения
+            stop_event = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGTERM, signal.SIGINT):
+                loop.add_signal_handler(sig, stop_event.set)
+            await stop_event.wait()
+            logger.info("Received stop signal, shutting down")
+        else:
+            # Telegram не отдает getUpdates, пока установлен вебхук
+            await bot_app.bot.delete_webhook()
+            await bot_app.dp.start_polling(bot_app.bot)
     except Exception as e:
         logger.error(f"Critical error during bot execution: {e}", exc_info=True)
     finally:
+        await bot_app.notifier.close()
+        await bot_app.archive.close()
+        logger.info(f"Outbound Telegram traffic: {bot_app.outbound.get_stats()}")
         with suppress(Exception):
             await bot_app.bot.session.close()
+        await bot_app.sheet_manager.close()
+        await bot_app.storage.close()
         await runner.cleanup()
         logger.info("Bot stopped")
 
@@ -0,0 +1,71 @@
+import asyncio
+import logging
+import time
+
+from aiogram.exceptions import TelegramAPIError
+
+from config import (
+    USERS_SHEET, NOTIFY_ADMINS_TTL, NOTIFY_CONCURRENCY,
+    UserFields, UserStatus
+)
+from outbound import bulk_sends
+
+logger = logging.getLogger(__name__)
+
+class AdminNotifier:
+    """Рассылка уведомлений администраторам.
+
+    Список администраторов кэшируется на NOTIFY_ADMINS_TTL. Сообщения отправляются
+    в фоне и параллельно (не больше NOTIFY_CONCURRENCY одновременно), поэтому
+    хэндлер, создавший уведомление, отвечает пользователю, не дожидаясь рассылки.
+    """
+
+    def __init__(self, bot, sheet_manager):
+        self.bot = bot
+        self.sheet_manager = sheet_manager
+        self._admin_ids = None
+        self._admin_ids_loaded_at = 0
+        self._semaphore = asyncio.Semaphore(NOTIFY_CONCURRENCY)
+        self._tasks = set()
+
+    def invalidate(self):
+        """Сбрасывает кэш администраторов, например после назначения нового."""
+        self._admin_ids = None
+
+    async def admin_ids(self):
+        if self._admin_ids is None or time.monotonic() - self._admin_ids_loaded_at > NOTIFY_ADMINS_TTL.total_seconds():
+            admins = await self.sheet_manager.query(USERS_SHEET, {UserFields.USER_STATUS: UserStatus.ADMIN}, fields=[UserFields.USER_ID])
+            self._admin_ids = [admin[UserFields.USER_ID] for admin in admins]
+            self._admin_ids_loaded_at = time.monotonic()
+        return self._admin_ids
+
+    def notify_admins(self, text, reply_markup=None, **kwargs):
+        """Ставит рассылку в очередь и сразу возвращает управление."""
+        task = asyncio.create_task(self._notify_admins(text, reply_markup=reply_markup, **kwargs))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _notify_admins(self, text, **kwargs):
+        try:
+            admin_ids = await self.admin_ids()
+        except Exception as e:
+            logger.error(f"Failed to load admins for notification: {e}", exc_info=True)
+            return
+        with bulk_sends():
+            await asyncio.gather(*(self.send(admin_id, text, **kwargs) for admin_id in admin_ids))
+
+    async def send(self, chat_id, text, **kwargs):
+        """Отправляет сообщение; паузы по ответу 429 выдерживает OutboundScheduler."""
+        async with self._semaphore:
+            try:
+                return await self.bot.send_message(chat_id=chat_id, text=text, **kwargs)
+            except TelegramAPIError as e:
+                # Администратор мог заблокировать бота — остальным все равно отправляем
+                logger.error(f"Failed to notify {chat_id}: {e}")
+                return None
+
+    async def close(self):
+        """Дожидается уже поставленных рассылок перед остановкой бота."""
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -14,7 +14,7 @@ class OnboardingStates(StatesGroup):
 async def start_onboarding(message: Message, state: FSMContext):
     user_id = str(message.from_user.id)
     sheet_manager = onboarding_router.sheet_manager
-    user_data = sheet_manager.get_data(USERS_SHEET, user_id)
+    user_data = await sheet_manager.get_data(USERS_SHEET, user_id)
     
     referral_count = sum(1 for field in [UserFields.REFERRAL1_ID, UserFields.REFERRAL2_ID] if user_data.get(field))
 
@@ -43,7 +43,7 @@ async def process_referral(message: Message, state: FSMContext):
         await message.answer(Messages.SELF_REFERRAL_ERROR)
         return
 
-    user_data = sheet_manager.get_data(USERS_SHEET, user_id)
+    user_data = await sheet_manager.get_data(USERS_SHEET, user_id)
     if user_data is None:
         await message.answer(Messages.ERROR_REFERRAL)
         return
@@ -52,13 +52,16 @@ async def process_referral(message: Message, state: FSMContext):
         await message.answer(Messages.DUPLICATE_REFERRAL)
         return
 
-    referral_data = next((user for user in sheet_manager.get_data(USERS_SHEET) if user[UserFields.USERNAME] == referral_username and user[UserFields.USER_STATUS] in [UserStatus.ADMIN, UserStatus.ACTIVE]), None)
+    referral_data = next(iter(await sheet_manager.query(USERS_SHEET, {
+        UserFields.USERNAME: referral_username,
+        UserFields.USER_STATUS: [UserStatus.ADMIN, UserStatus.ACTIVE]
+    })), None)
     if not referral_data:
         await message.answer(Messages.UNKNOWN_REFERRAL)
         return
 
     referral_field = UserFields.REFERRAL1_ID if not user_data.get(UserFields.REFERRAL1_ID) else UserFields.REFERRAL2_ID
-    sheet_manager.batch_update(USERS_SHEET, user_id, {
+    await sheet_manager.batch_update(USERS_SHEET, user_id, {
         referral_field: referral_data[UserFields.USER_ID],
         f'{referral_field[:-3]}_USERNAME': referral_username,
         f'{referral_field[:-3]}_STATUS': 'ask'
@@ -70,7 +73,7 @@ async def process_referral(message: Message, state: FSMContext):
 
 async def send_referral_request(user_id: str, referral_id: str):
     sheet_manager = onboarding_router.sheet_manager
-    user_data = sheet_manager.get_data(USERS_SHEET, user_id)
+    user_data = await sheet_manager.get_data(USERS_SHEET, user_id)
     
     sent_message = await onboarding_router.bot.send_message(
         chat_id=referral_id,
@@ -78,7 +81,7 @@ async def send_referral_request(user_id: str, referral_id: str):
         reply_markup=UIUX.referral_actions(user_id)
     )
     
-    sheet_manager.batch_update(USERS_SHEET, user_id, {f"{UserFields.REFERRAL1_MESSAGE_ID if referral_id == user_data[UserFields.REFERRAL1_ID] else UserFields.REFERRAL2_MESSAGE_ID}": sent_message.message_id})
+    await sheet_manager.batch_update(USERS_SHEET, user_id, {f"{UserFields.REFERRAL1_MESSAGE_ID if referral_id == user_data[UserFields.REFERRAL1_ID] else UserFields.REFERRAL2_MESSAGE_ID}": sent_message.message_id})
 
 @onboarding_router.callback_query(F.data.startswith("confirm_referral_"))
 async def confirm_referral(callback: CallbackQuery):
@@ -86,14 +89,14 @@ async def confirm_referral(callback: CallbackQuery):
     user_id = callback.data.split('_')[2]
     referral_id = str(callback.from_user.id)
     
-    user_data = sheet_manager.get_data(USERS_SHEET, user_id)
+    user_data = await sheet_manager.get_data(USERS_SHEET, user_id)
     if user_data is None:
         await callback.answer(Messages.REFERRAL_NOT_EXIST)
         return
 
     referral_field = 'REFERRAL1' if user_data.get('REFERRAL1_ID') == referral_id else 'REFERRAL2'
     
-    sheet_manager.batch_update(USERS_SHEET, user_id, {f'{referral_field}_STATUS': 'ok'})
+    await sheet_manager.batch_update(USERS_SHEET, user_id, {f'{referral_field}_STATUS': 'ok'})
     
     await callback.answer(Messages.REFERRAL_APPROVE.format(username=user_data[UserFields.USERNAME]))
     await callback.message.edit_text(Messages.REFERRAL_APPROVE.format(username=user_data[UserFields.USERNAME]), reply_markup=None)
@@ -116,10 +119,10 @@ async def doubt_referral(callback: CallbackQuery):
     user_id = callback.data.split('_')[1]
     referral_id = str(callback.from_user.id)
     
-    user_data = sheet_manager.get_data(USERS_SHEET, user_id)
+    user_data = await sheet_manager.get_data(USERS_SHEET, user_id)
     referral_field = 'REFERRAL1' if user_data['REFERRAL1_ID'] == referral_id else 'REFERRAL2'
     
-    sheet_manager.batch_update(USERS_SHEET, user_id, {f'{referral_field}_STATUS': 'notsure'})
+    await sheet_manager.batch_update(USERS_SHEET, user_id, {f'{referral_field}_STATUS': 'notsure'})
     await callback.answer(Messages.REFERRAL_REJECT)
     await callback.message.edit_text(Messages.REFERRAL_REJECT, reply_markup=None)
     await check_user_status(user_id)
@@ -128,20 +131,20 @@ async def doubt_referral(callback: CallbackQuery):
 async def ban_user(callback: CallbackQuery):
     sheet_manager = onboarding_router.sheet_manager
     user_id = callback.data.split('_')[1]
-    user_data = sheet_manager.get_data(USERS_SHEET, user_id)
-    sheet_manager.batch_update(USERS_SHEET, user_id, {'USER_STATUS': 'ban'})
+    user_data = await sheet_manager.get_data(USERS_SHEET, user_id)
+    await sheet_manager.batch_update(USERS_SHEET, user_id, {'USER_STATUS': 'ban'})
     await callback.answer(Messages.REFERRAL_BAN.format(username=user_data[UserFields.USERNAME]))
     await callback.message.edit_text(Messages.REFERRAL_BAN.format(username=user_data[UserFields.USERNAME]), reply_markup=None)
     await onboarding_router.bot.send_message(chat_id=user_id, text=Messages.USER_BANNED)
 
 async def check_user_status(user_id: str):
     sheet_manager = onboarding_router.sheet_manager
-    user_data = sheet_manager.get_data(USERS_SHEET, user_id)
+    user_data = await sheet_manager.get_data(USERS_SHEET, user_id)
     referral1_status = user_data.get(UserFields.REFERRAL1_STATUS)
     referral2_status = user_data.get(UserFields.REFERRAL2_STATUS)
 
     if 'ok' in [referral1_status, referral2_status]:
-        sheet_manager.batch_update(USERS_SHEET, user_id, {
+        await sheet_manager.batch_update(USERS_SHEET, user_id, {
             UserFields.USER_STATUS: UserStatus.ACTIVE,
             UserFields.USER_STATE: 'user_menu'
         })
@@ -154,5 +157,5 @@ async def check_user_status(user_id: str):
         )
 
     elif referral1_status == 'notsure' and referral2_status == 'notsure':
-        sheet_manager.batch_update(USERS_SHEET, user_id, {UserFields.USER_STATUS: UserStatus.BAN})
+        await sheet_manager.batch_update(USERS_SHEET, user_id, {UserFields.USER_STATUS: UserStatus.BAN})
         await onboarding_router.bot.send_message(chat_id=user_id, text=Messages.ACCOUNT_BANNED)
\ No newline at end of file
@@ -0,0 +1,155 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from config import (
+    TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_BURST, TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST,
+    TELEGRAM_MAX_RETRIES
+)
+
+logger = logging.getLogger(__name__)
+
+# Полосы приоритета: меньше — раньше
+PRIORITY_REPLY = 0
+PRIORITY_BULK = 1
+LANE_NAMES = {PRIORITY_REPLY: 'reply', PRIORITY_BULK: 'bulk'}
+
+_priority = ContextVar('outbound_priority', default=PRIORITY_REPLY)
+
+@contextmanager
+def bulk_sends():
+    """Сообщения, отправленные внутри блока, пропускают вперед ответы пользователям."""
+    token = _priority.set(PRIORITY_BULK)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+class PriorityGate:
+    """Token bucket, который при нехватке токенов выдает их сначала более приоритетным."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self._waiters = []  # куча (приоритет, порядковый номер, future)
+        self._seq = itertools.count()
+        self._pump_task = None
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    @property
+    def waiting(self):
+        return len(self._waiters)
+
+    @property
+    def idle(self):
+        self._refill()
+        return not self._waiters and self.tokens >= self.capacity
+
+    async def acquire(self, priority):
+        self._refill()
+        if not self._waiters and self.tokens >= 1:
+            self.tokens -= 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.create_task(self._pump())
+        await future
+
+    async def _pump(self):
+        while self._waiters:
+            self._refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                continue
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.tokens -= 1
+                future.set_result(None)
+
+class OutboundScheduler(BaseRequestMiddleware):
+    """Middleware сессии aiogram, ограничивающий частоту исходящих сообщений.
+
+    Запросы с chat_id проходят через token bucket своего чата (TELEGRAM_CHAT_RATE)
+    и общий (TELEGRAM_GLOBAL_RATE). Ответы пользователям обслуживаются раньше
+    массовых рассылок, помеченных bulk_sends(). Если Telegram все же вернул 429,
+    запрос повторяется после паузы retry_after.
+    """
+
+    _MAX_IDLE_CHATS = 10_000
+
+    def __init__(self):
+        self.global_gate = PriorityGate(TELEGRAM_GLOBAL_RATE, TELEGRAM_GLOBAL_BURST)
+        self.chat_gates = {}
+        self.stats = Counter()
+        self.max_wait = Counter()  # полоса -> максимальное ожидание, секунды
+
+    def _chat_gate(self, chat_id):
+        gate = self.chat_gates.get(chat_id)
+        if gate is None:
+            if len(self.chat_gates) >= self._MAX_IDLE_CHATS:
+                self.chat_gates = {key: value for key, value in self.chat_gates.items() if not value.idle}
+            gate = self.chat_gates[chat_id] = PriorityGate(TELEGRAM_CHAT_RATE, TELEGRAM_CHAT_BURST)
+        return gate
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        priority = _priority.get()
+        lane = LANE_NAMES[priority]
+        for attempt in range(TELEGRAM_MAX_RETRIES + 1):
+            queued_at = time.monotonic()
+            self.stats[f'{lane}_queued'] += 1
+            try:
+                await self._chat_gate(chat_id).acquire(priority)
+                await self.global_gate.acquire(priority)
+            finally:
+                self.stats[f'{lane}_queued'] -= 1
+            waited = time.monotonic() - queued_at
+            self.stats[f'{lane}_sent'] += 1
+            self.stats[f'{lane}_wait_seconds'] += waited
+            self.max_wait[lane] = max(self.max_wait[lane], waited)
+
+            started = time.monotonic()
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.stats['retry_after'] += 1
+                if attempt == TELEGRAM_MAX_RETRIES:
+                    raise
+                logger.warning(f"Telegram flood control for chat {chat_id}, retrying in {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+            finally:
+                self.stats['request_seconds'] += time.monotonic() - started
+
+    def get_stats(self):
+        stats = {
+            'queue_depth': {lane: self.stats[f'{lane}_queued'] for lane in LANE_NAMES.values()},
+            'retry_after': self.stats['retry_after'],
+        }
+        for lane in LANE_NAMES.values():
+            sent = self.stats[f'{lane}_sent']
+            stats[lane] = {
+                'sent': sent,
+                'avg_wait': self.stats[f'{lane}_wait_seconds'] / sent if sent else 0,
+                'max_wait': self.max_wait[lane],
+            }
+        sent = sum(stats[lane]['sent'] for lane in LANE_NAMES.values())
+        stats['avg_request_seconds'] = self.stats['request_seconds'] / sent if sent else 0
+        return stats
@@ -0,0 +1,74 @@
+import logging
+from functools import cached_property
+from typing import NamedTuple
+
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+
+from config import RATES_SHEET, Messages, RateFields
+
+logger = logging.getLogger(__name__)
+
+class RateInfo(NamedTuple):
+    rate: float
+    min_amount: float
+
+class RatesIndex:
+    """Курсы, разобранные один раз на каждую версию листа Rates.
+
+    Хранит отсортированный список исходных валют, целевые валюты для каждой
+    исходной, разобранные курс и минимальную сумму для каждой пары и готовые
+    клавиатуры выбора валют, поэтому шаги обмена не перебирают лист заново.
+    """
+
+    def __init__(self, rates):
+        self.pairs = {}
+        for rate in rates:
+            source = rate[RateFields.SOURCE_CURRENCY]
+            target = rate[RateFields.TARGET_CURRENCY]
+            if not source or not target or (source, target) in self.pairs:
+                continue
+            try:
+                self.pairs[(source, target)] = RateInfo(
+                    float(rate[RateFields.RATE]),
+                    float(rate[RateFields.MIN_AMOUNT].replace(',', ''))
+                )
+            except (TypeError, ValueError, AttributeError):
+                logger.warning(f"Skipping rate {source} -> {target} with invalid values: {dict(rate)}")
+
+        targets = {}
+        for source, target in self.pairs:
+            targets.setdefault(source, []).append(target)
+        self.sources = sorted(targets)
+        self.targets = {source: sorted(values) for source, values in targets.items()}
+
+        self.source_keyboard = self._keyboard(self.sources, 'source')
+        self.target_keyboards = {source: self._keyboard(values, 'target') for source, values in self.targets.items()}
+
+    @staticmethod
+    def _keyboard(currencies, prefix):
+        kb = InlineKeyboardBuilder()
+        for currency in currencies:
+            kb.button(text=currency, callback_data=f"{prefix}_{currency}")
+        kb.adjust(3)
+        return kb.as_markup()
+
+    @cached_property
+    def rates_message(self):
+        """Текст «Посмотреть курсы». Индекс пересобирается при каждом изменении листа,
+        поэтому между изменениями курсов текст форматируется один раз."""
+        response = Messages.CURRENT_EXCHANGE_RATES
+        for (source, target), info in self.pairs.items():
+            if source != target and not (source in target or target in source):
+                response += Messages.EXCHANGE_RATE_FORMAT.format(
+                    source=source,
+                    rate=info.rate,
+                    target=target,
+                    min_amount=int(info.min_amount)
+                )
+        return response
+
+    def target_keyboard(self, source_currency):
+        return self.target_keyboards.get(source_currency) or self._keyboard([], 'target')
+
+async def get_rates_index(sheet_manager):
+    return await sheet_manager.get_derived(RATES_SHEET, 'rates_index', RatesIndex)
@@ -0,0 +1,109 @@
+import bisect
+import heapq
+import math
+from datetime import datetime, timedelta
+
+from config import (
+    REQUESTS_SHEET, USERS_SHEET, REPORT_MESSAGE_LIMIT, REPORT_MAX_MESSAGES,
+    Messages, RequestFields, RequestStatus, UserFields
+)
+
+class CompletedRequests:
+    """Выполненные заявки по дате завершения; ISO-даты сортируются как строки, окно — два bisect."""
+
+    def __init__(self, requests):
+        self.all = sorted(requests, key=lambda req: req[RequestFields.UPDATED_AT] or '')
+        self.dates = [req[RequestFields.UPDATED_AT] or '' for req in self.all]
+        self.by_pair = {}
+        for req in self.all:
+            pair = (req[RequestFields.SOURCE_CURRENCY], req[RequestFields.TARGET_CURRENCY])
+            self.by_pair.setdefault(pair, []).append(req)
+        self.pair_dates = {pair: [req[RequestFields.UPDATED_AT] or '' for req in reqs] for pair, reqs in self.by_pair.items()}
+
+    def window(self, date_from=None, date_to=None, pair=None):
+        """Заявки, завершенные с date_from до date_to включительно (даты — datetime.date)."""
+        requests, dates = (self.by_pair.get(pair, []), self.pair_dates.get(pair, [])) if pair else (self.all, self.dates)
+        start = bisect.bisect_left(dates, date_from.isoformat()) if date_from else 0
+        end = bisect.bisect_left(dates, (date_to + timedelta(days=1)).isoformat()) if date_to else len(requests)
+        return requests[start:end]
+
+async def get_completed_requests(sheet_manager):
+    return await sheet_manager.get_derived(
+        REQUESTS_SHEET, 'completed_requests', CompletedRequests,
+        filters={RequestFields.STATUS: RequestStatus.DONE}
+    )
+
+async def get_archived_completed_requests(archive):
+    return await archive.get_derived(
+        'completed_requests',
+        lambda requests: CompletedRequests([req for req in requests if req[RequestFields.STATUS] == RequestStatus.DONE])
+    )
+
+async def get_usernames(sheet_manager, user_ids):
+    """Имена пользователей одним проходом по кэшу листа Users."""
+    users = await sheet_manager.get_multiple_data(USERS_SHEET, list(user_ids), fields=[UserFields.USER_ID, UserFields.USERNAME])
+    return {user[UserFields.USER_ID]: user[UserFields.USERNAME] for user in users}
+
+def iter_report_lines(requests, usernames):
+    for req in requests:
+        username = usernames.get(req[RequestFields.USER_ID]) or Messages.UNKNOWN_USER
+        updated_at = req[RequestFields.UPDATED_AT] or ''
+        completed_date = f"{updated_at[8:10]}/{updated_at[5:7]}/{updated_at[2:4]}" if len(updated_at) >= 10 else updated_at
+        yield (
+            f"@{username}: {math.ceil(float(req[RequestFields.AMOUNT])):,} {req[RequestFields.SOURCE_CURRENCY]} -> "
+            f"{math.ceil(float(req[RequestFields.RESULT])):,} {req[RequestFields.TARGET_CURRENCY]}, {completed_date}\n"
+        )
+
+def iter_chunks(lines, header='', limit=REPORT_MESSAGE_LIMIT):
+    """Склеивает строки в сообщения не длиннее limit символов."""
+    chunk = header
+    for line in lines:
+        if chunk and len(chunk) + len(line) > limit:
+            yield chunk
+            chunk = ''
+        chunk += line
+    if chunk:
+        yield chunk
+
+REPORT_DATE_FORMATS = ("%d.%m.%y", "%d.%m.%Y", "%d/%m/%y", "%d/%m/%Y")
+
+def parse_report_filters(args):
+    """(date_from, date_to, pair) из аргументов вида 01.02.24 01/03/24 USDT-RUB; иначе ValueError."""
+    dates = []
+    pair = None
+    for arg in (args or '').split():
+        for date_format in REPORT_DATE_FORMATS:
+            try:
+                dates.append(datetime.strptime(arg, date_format).date())
+                break
+            except ValueError:
+                continue
+        else:
+            source, _, target = arg.replace('/', '-').partition('-')
+            # Стороны пары — коды валют из букв, иначе 01/02 без года стало бы парой
+            if not source.isalpha() or not target.isalpha():
+                raise ValueError(arg)
+            pair = (source.upper(), target.upper())
+    if len(dates) > 2:
+        raise ValueError(args)
+    date_from = dates[0] if dates else None
+    date_to = dates[1] if len(dates) > 1 else None
+    return date_from, date_to, pair
+
+async def build_completed_report(sheet_manager, date_from=None, date_to=None, pair=None, archive=None):
+    """(сообщения, текст для файла); архив читается, только если период его затрагивает."""
+    requests = (await get_completed_requests(sheet_manager)).window(date_from, date_to, pair)
+    if archive and archive.enabled and (date_from is None or date_from <= archive.cutoff().date()):
+        archived = (await get_archived_completed_requests(archive)).window(date_from, date_to, pair)
+        hot_ids = {req[RequestFields.REQUEST_ID] for req in requests}
+        archived = [req for req in archived if req[RequestFields.REQUEST_ID] not in hot_ids]
+        requests = list(heapq.merge(archived, requests, key=lambda req: req[RequestFields.UPDATED_AT] or ''))
+    if not requests:
+        return [], None
+    usernames = await get_usernames(sheet_manager, {req[RequestFields.USER_ID] for req in requests})
+    chunks = []
+    for chunk in iter_chunks(iter_report_lines(requests, usernames), Messages.COMPLETED_REQUESTS_HEADER):
+        chunks.append(chunk)
+        if len(chunks) > REPORT_MAX_MESSAGES:
+            return [], Messages.COMPLETED_REQUESTS_HEADER + ''.join(iter_report_lines(requests, usernames))
+    return chunks, None
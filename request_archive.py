@@ -0,0 +1,119 @@
+import asyncio
+import logging
+from contextlib import suppress
+from datetime import datetime, timedelta
+
+from config import (
+    ARCHIVE_AFTER, ARCHIVE_CACHE_TTL, ARCHIVE_ENABLED, ARCHIVE_INTERVAL, REQUESTS_ARCHIVE_SHEET, REQUESTS_SHEET,
+    RequestFields, RequestStatus
+)
+
+logger = logging.getLogger(__name__)
+
+FINISHED_STATUSES = [RequestStatus.DONE, RequestStatus.CANCEL]
+
+class RequestArchive:
+    """Холодное хранилище завершенных заявок на листе RequestsArchive.
+
+    Выполненные и отмененные заявки старше ARCHIVE_AFTER переносятся с листа Requests
+    в архив, поэтому кэш и каждая перезагрузка листа Requests растут только с числом
+    недавних заявок. Архив не держится в кэше: заявка ищется по id одним запросом,
+    а полный список для отчетов и аналитики читается по требованию и забывается
+    через ARCHIVE_CACHE_TTL.
+    """
+
+    def __init__(self, sheet_manager):
+        self.sheet_manager = sheet_manager
+        self.listeners = []  # вызываются со списком перенесенных в архив заявок
+        self._entries = None
+        self._entries_expire = datetime.min
+        self._derived = {}  # имя -> (список заявок, из которого построено, значение)
+        self._task = None
+        self._wakeup = asyncio.Event()
+
+    @property
+    def enabled(self):
+        return ARCHIVE_ENABLED
+
+    def cutoff(self):
+        """Заявки, завершенные раньше этого момента, уходят в архив."""
+        return datetime.now() - ARCHIVE_AFTER
+
+    def start(self):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._archiver_loop())
+
+    async def close(self):
+        if self._task:
+            self._task.cancel()
+            with suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+
+    def request_finished(self):
+        """Заявку выполнили или отменили: при ARCHIVE_AFTER = 0 она сразу уходит в архив."""
+        if self.enabled and ARCHIVE_AFTER <= timedelta(0):
+            self._wakeup.set()
+
+    async def _archiver_loop(self):
+        while True:
+            # Заявки, завершенные во время переноса, разбудят цикл еще раз
+            self._wakeup.clear()
+            try:
+                await self.archive_finished()
+            except Exception as e:
+                logger.error(f"Failed to archive finished requests: {e}", exc_info=True)
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), ARCHIVE_INTERVAL.total_seconds())
+
+    async def archive_finished(self):
+        """Переносит в архив завершенные заявки старше ARCHIVE_AFTER. Возвращает их число."""
+        if self.sheet_manager.mirror:
+            # Зеркало вернуло бы удаленные строки из Google Sheets обратно в локальную базу
+            logger.warning("Archiving requests is not supported with the Google Sheets mirror, skipping")
+            return 0
+
+        cutoff = self.cutoff().isoformat()
+
+        def is_old_finished(request):
+            finished_at = request[RequestFields.UPDATED_AT] or request[RequestFields.CREATED_AT]
+            return request[RequestFields.STATUS] in FINISHED_STATUSES and bool(finished_at) and finished_at < cutoff
+
+        moved = await self.sheet_manager.move_entries(REQUESTS_SHEET, REQUESTS_ARCHIVE_SHEET, is_old_finished)
+        if moved:
+            self._forget()
+            for listener in self.listeners:
+                listener(moved)
+            logger.info(f"Archived {len(moved)} finished requests")
+        return len(moved)
+
+    async def get(self, request_id):
+        return await self.sheet_manager.find_cold_entry(REQUESTS_ARCHIVE_SHEET, request_id)
+
+    async def load(self):
+        """Все заявки архива, по одной на id."""
+        if self._entries is None or datetime.now() > self._entries_expire:
+            entries = await self.sheet_manager.get_cold_entries(REQUESTS_ARCHIVE_SHEET)
+            # После сбоя во время переноса заявка может попасть в архив дважды
+            self._entries = list({entry[RequestFields.REQUEST_ID]: entry for entry in entries}.values())
+            self._entries_expire = datetime.now() + ARCHIVE_CACHE_TTL
+            self._derived = {}
+            asyncio.get_running_loop().call_later(ARCHIVE_CACHE_TTL.total_seconds(), self._forget_expired)
+        return self._entries
+
+    async def get_derived(self, name, build):
+        """build(заявки архива), пересчитанное только после новой загрузки архива."""
+        entries = await self.load()
+        cached = self._derived.get(name)
+        if cached is None or cached[0] is not entries:
+            cached = (entries, build(entries))
+            self._derived[name] = cached
+        return cached[1]
+
+    def _forget_expired(self):
+        if datetime.now() >= self._entries_expire:
+            self._forget()
+
+    def _forget(self):
+        self._entries = None
+        self._derived = {}
@@ -0,0 +1,61 @@
+import logging
+import socket
+import threading
+import time
+import zlib
+
+from config import REQUEST_ID_EPOCH
+
+logger = logging.getLogger(__name__)
+
+# Base32 Крокфорда: без I, L, O и U, которые легко спутать с цифрами
+ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'
+TIME_LENGTH = 6  # 32**6 секунд — около 34 лет от REQUEST_ID_EPOCH
+
+def encode(value, length):
+    chars = []
+    for _ in range(length):
+        value, digit = divmod(value, len(ALPHABET))
+        chars.append(ALPHABET[digit])
+    return ''.join(reversed(chars))
+
+def host_node():
+    """Символ узла по имени хоста: не меняется между перезапусками на той же машине."""
+    return ALPHABET[zlib.crc32(socket.gethostname().encode()) % len(ALPHABET)]
+
+class RequestIdAllocator:
+    """Короткие возрастающие номера заявок: 6 символов времени и символ узла.
+
+    Временная часть — секунды от REQUEST_ID_EPOCH, но не меньше предыдущего номера
+    плюс один, поэтому в пределах процесса номера строго растут и не повторяются
+    даже при нескольких заявках в секунду. Символ узла разделяет процессы бота
+    (REQUEST_ID_NODE, иначе выводится из имени хоста), а проверка по множеству уже
+    известных номеров защищает от повторов после перезапуска с отстающими часами.
+    """
+
+    def __init__(self, node=None, epoch=REQUEST_ID_EPOCH):
+        if not node:
+            node = host_node()
+            # Один символ не сделать уникальным автоматически: двум процессам нужен явный REQUEST_ID_NODE
+            logger.warning(
+                f"REQUEST_ID_NODE is not set, using node '{node}' derived from the host name. "
+                f"Set a distinct REQUEST_ID_NODE for every bot instance sharing the spreadsheet"
+            )
+        if len(node) != 1 or node not in ALPHABET:
+            raise ValueError(f"Request ID node must be one of '{ALPHABET}', got '{node}'")
+        self.node = node
+        self.epoch = epoch.timestamp()
+        self._last = -1
+        self._lock = threading.Lock()
+
+    def _next_tick(self):
+        with self._lock:
+            self._last = max(int(time.time() - self.epoch), self._last + 1)
+            return self._last
+
+    def next_id(self, taken=()):
+        """Новый номер, которого нет в taken (множество или представление ключей кэша)."""
+        while True:
+            request_id = encode(self._next_tick(), TIME_LENGTH) + self.node
+            if request_id not in taken:
+                return request_id
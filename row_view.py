@@ -0,0 +1,26 @@
+from collections.abc import Mapping
+
+class RowView(Mapping):
+    """Read-only представление строки кэша в виде словаря поле -> значение.
+
+    Не копирует данные: хранит ссылку на строку кэша и общую для всего листа
+    схему `{поле: индекс колонки}`, поэтому создание представления стоит O(1).
+    """
+    __slots__ = ('_fields', '_row')
+
+    def __init__(self, fields, row):
+        self._fields = fields
+        self._row = row
+
+    def __getitem__(self, field):
+        index = self._fields[field]
+        return self._row[index] if index < len(self._row) else None
+
+    def __iter__(self):
+        return iter(self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __repr__(self):
+        return repr(dict(self))
@@ -0,0 +1,42 @@
+from typing import NamedTuple
+
+class SheetSchema(NamedTuple):
+    version: int
+    headers: tuple
+    field_indices: dict  # поле -> индекс колонки
+
+    @property
+    def width(self):
+        return len(self.headers)
+
+class SchemaRegistry:
+    """Заголовки листов и построенные по ним индексы полей, с версией на каждый лист.
+
+    Версия растет только при настоящем изменении заголовков, поэтому проверка
+    после перезагрузки листа или ошибки записи — одно сравнение кортежей.
+    """
+
+    def __init__(self):
+        self.schemas = {}
+
+    def get(self, sheet_name):
+        return self.schemas.get(sheet_name)
+
+    def update(self, sheet_name, headers):
+        """Запоминает заголовки листа. Возвращает True, если они изменились."""
+        headers = tuple(headers)
+        current = self.schemas.get(sheet_name)
+        if current is not None and current.headers == headers:
+            return False
+        field_indices = {header: index for index, header in enumerate(headers) if header}
+        self.schemas[sheet_name] = SheetSchema(current.version + 1 if current else 1, headers, field_indices)
+        return True
+
+def remap_row(row, old_indices, new_indices, width):
+    """Строка в раскладке new_indices; значения колонок, которых больше нет, отбрасываются."""
+    new_row = [''] * width
+    for field, index in new_indices.items():
+        old_index = old_indices.get(field)
+        if old_index is not None and old_index < len(row):
+            new_row[index] = row[old_index]
+    return new_row
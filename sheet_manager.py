@@ -1,203 +1,887 @@
 from asyncio.log import logger
-import json
-import gspread
-from google.oauth2.service_account import Credentials
-from config import G_SHEET_CRED, CACHE_TTL, RATES_SHEET, REQUESTS_SHEET, USERS_SHEET, RateFields, RequestFields, UserFields
+import asyncio
+import functools
+from collections import Counter
+from contextlib import suppress
+from concurrent.futures import ThreadPoolExecutor
+from config import (
+    CACHE_TTL, CACHE_TTLS, CACHE_UPDATE_INTERVAL, CACHE_RETRY_INTERVAL, CACHE_SNAPSHOT_PATH, CACHE_SNAPSHOT_INTERVAL, SHEETS_MAX_WORKERS,
+    WRITE_AHEAD_LOG_PATH, WRITE_BEHIND_INTERVAL, STORAGE_BACKEND, SQLITE_PATH, SHEETS_MIRROR_ENABLED, MIRROR_SYNC_INTERVAL, SHEET_HEADERS,
+    ANALYTICS_SHEET, RATES_SHEET, REQUESTS_ARCHIVE_SHEET, REQUESTS_SHEET, USERS_SHEET, AnalyticsFields, RateFields, RequestFields, UserFields
+)
 from datetime import datetime
+from cache_snapshot import CacheSnapshot
+from row_view import RowView
+from schema_registry import SchemaRegistry, remap_row
+from sheets_mirror import SheetsMirror
+from storage import SheetsBackend, SQLiteBackend
+from write_ahead_log import WriteAheadLog
 
 class SheetManager:
-    def __init__(self, spreadsheet_id):
+    def __init__(self, spreadsheet_id, backend=None, mirror=None, snapshot_path=None):
         self.spreadsheet_id = spreadsheet_id
-        self.sheets = {}
-        self.field_indices = {}
+        self.sheets = set()
+        self.field_indices = {}  # лист -> индексы полей текущей схемы из self.schemas
+        self.schemas = SchemaRegistry()
         self.cache = {}
         self.cache_ttl = {}
+        self.row_numbers = {}  # id записи -> номер строки на листе
+        self.last_refreshed = {}
         self.id_fields = {
             USERS_SHEET: UserFields.USER_ID,
             REQUESTS_SHEET: RequestFields.REQUEST_ID,
-            RATES_SHEET: RateFields.SOURCE_CURRENCY
+            RATES_SHEET: RateFields.SOURCE_CURRENCY,
+            ANALYTICS_SHEET: AnalyticsFields.METRIC,
+            REQUESTS_ARCHIVE_SHEET: RequestFields.REQUEST_ID
         }
-        self.client = self._get_client()
-        self._init_sheets()
+        # Холодные листы не загружаются в кэш: их строки читаются из хранилища по запросу
+        self.cold_sheets = {REQUESTS_ARCHIVE_SHEET}
+        # Вторичные индексы: лист -> поле -> значение -> {id: None} (упорядоченное множество)
+        self.index_fields = {
+            USERS_SHEET: [UserFields.USERNAME, UserFields.USER_STATUS],
+            REQUESTS_SHEET: [RequestFields.USER_ID, RequestFields.STATUS],
+        }
+        self.indexes = {}
+        self._projections = {}  # (лист, поля) -> общая схема для RowView
+        # Версия данных листа растет при каждой перезагрузке и изменении строк;
+        # по ней get_derived понимает, что производные данные пора пересчитать
+        self.versions = Counter()
+        self._derived = {}  # (лист, имя) -> (версия, значение)
+        self.reload_listeners = []  # вызываются с именем листа после каждой перезагрузки
+        # Все блокирующие вызовы хранилища выполняются в отдельном пуле потоков,
+        # чтобы не останавливать цикл событий aiogram
+        self._executor = ThreadPoolExecutor(max_workers=SHEETS_MAX_WORKERS, thread_name_prefix='sheets')
+        self._refresh_tasks = {}
+        self._refresher_task = None
+        # Отложенная запись: изменения сразу попадают в кэш и журнал на диске,
+        # а в Google Sheets уходят пачками раз в WRITE_BEHIND_INTERVAL
+        self._pending_updates = {}  # лист -> id -> {поле: значение}
+        self._pending_appends = {}  # лист -> id -> строка
+        self._inflight = ({}, {})  # пачка, которая сейчас отправляется в Sheets
+        self._flush_lock = asyncio.Lock()
+        self._flusher_task = None
+        self._flush_generation = 0
+        self._mirror_synced = datetime.min  # первая сверка с зеркалом — сразу после запуска
+        self.wal = WriteAheadLog(WRITE_AHEAD_LOG_PATH)
+        self.api_calls = Counter()  # (лист, операция) -> число обращений к хранилищу
+        # Снимок кэша нужен, только когда данные живут в Google Sheets: локальная база и так на диске
+        if snapshot_path is None and backend is None and STORAGE_BACKEND == 'sheets':
+            snapshot_path = CACHE_SNAPSHOT_PATH
+        self.snapshot = CacheSnapshot(snapshot_path) if snapshot_path else None
+        self._snapshot_versions = None
+        self._snapshot_saved = datetime.min
+        self._connect_lock = asyncio.Lock()
+        self.backend = backend
+        self.mirror = mirror
+        if not self._restore_snapshot():
+            if self.backend is None:
+                self.backend, self.mirror = self._create_backends(spreadsheet_id)
+            self._init_sheets()
+        self._replay_write_ahead_log()
+
+    async def _run(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+
+    async def _call(self, sheet_name, operation, *args, **kwargs):
+        # Все обращения к хранилищу идут через этот метод, чтобы видеть расход квоты
+        await self._ensure_backend()
+        self.api_calls[(sheet_name, operation)] += 1
+        return await self._run(getattr(self.backend, operation), sheet_name, *args, **kwargs)
 
-    def _get_client(self):
-        scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
-        if isinstance(G_SHEET_CRED, Credentials):
-            creds = G_SHEET_CRED
+    async def _ensure_backend(self):
+        # После старта из снимка подключаемся к Google Sheets только при первом обращении
+        if self.backend is not None:
+            return
+        async with self._connect_lock:
+            if self.backend is None:
+                self.backend, self.mirror = await self._run(self._create_backends, self.spreadsheet_id)
+                logger.info("Connected to Google Sheets after starting from cache snapshot")
+
+    def get_api_stats(self):
+        sheets_backend = self.mirror.sheets if self.mirror else self.backend
+        return {
+            'calls': dict(self.api_calls),
+            'transport': getattr(sheets_backend, 'stats', {}),
+        }
+
+    def start(self):
+        if self._refresher_task is None:
+            self._refresher_task = asyncio.create_task(self._refresher_loop())
+        if self._flusher_task is None:
+            self._flusher_task = asyncio.create_task(self._flusher_loop())
+
+    async def close(self):
+        for task in (self._refresher_task, self._flusher_task):
+            if task:
+                task.cancel()
+                with suppress(asyncio.CancelledError):
+                    await task
+        self._refresher_task = None
+        self._flusher_task = None
+        if not await self.flush():
+            logger.error("Unflushed changes remain in the write-ahead log and will be replayed on next start")
         else:
-            creds = Credentials.from_service_account_info(json.loads(G_SHEET_CRED), scopes=scope)
-        return gspread.authorize(creds)
+            # Последние изменения уходят в зеркало сейчас, а не после следующего запуска
+            await self.sync_mirror(force=True)
+        await self.save_snapshot(force=True)
+        self.wal.close()
+        self._executor.shutdown(wait=True)
+        if hasattr(self.backend, 'close'):
+            self.backend.close()
+        logger.info(f"Sheets API usage: {self.get_api_stats()}")
+
+    def _create_backends(self, spreadsheet_id):
+        if STORAGE_BACKEND == 'sqlite':
+            indexed_fields = {
+                sheet_name: [self.id_fields[sheet_name]] + self.index_fields.get(sheet_name, [])
+                for sheet_name in self.id_fields
+            }
+            indexed_fields[RATES_SHEET].append(RateFields.TARGET_CURRENCY)
+            store = SQLiteBackend(SQLITE_PATH, SHEET_HEADERS, indexed_fields)
+            mirror = None
+            if spreadsheet_id and SHEETS_MIRROR_ENABLED:
+                key_fields = {sheet_name: [id_field] for sheet_name, id_field in self.id_fields.items()}
+                key_fields[RATES_SHEET] = [RateFields.SOURCE_CURRENCY, RateFields.TARGET_CURRENCY]
+                mirror = SheetsMirror(store, SheetsBackend(spreadsheet_id), key_fields)
+            return store, mirror
+        if STORAGE_BACKEND != 'sheets':
+            raise ValueError(f"Unknown storage backend '{STORAGE_BACKEND}'")
+        return SheetsBackend(spreadsheet_id), None
 
     def _init_sheets(self):
-        spreadsheet = self.client.open_by_key(self.spreadsheet_id)
-        for worksheet in spreadsheet.worksheets():
-            sheet_name = worksheet.title
-            self.sheets[sheet_name] = worksheet
-            self._init_field_indices(sheet_name)
-        self._cache_data()  # Вызываем _cache_data только один раз после инициализации всех листов
+        # Заголовки и данные всех листов приходят одним запросом: из первой строки
+        # строятся индексы полей, остальное сразу попадает в кэш
+        self.api_calls[('*', 'get_all_sheets_values')] += 1
+        sheet_values = self.backend.get_all_sheets_values(
+            [sheet_name for sheet_name in self.backend.sheet_names() if sheet_name not in self.cold_sheets]
+        )
+        if self.mirror:
+            empty = [sheet_name for sheet_name, all_values in sheet_values.items() if len(all_values) <= 1]
+            for sheet_name in empty:
+                # Пустая локальная база — первый раз загружаем данные из Google Sheets
+                self.mirror.sync(sheet_name)
+                sheet_values[sheet_name] = self.backend.get_all_values(sheet_name)
+        for sheet_name, all_values in sheet_values.items():
+            self.sheets.add(sheet_name)
+            self._store_sheet_values(sheet_name, all_values)
+
+    def _restore_snapshot(self):
+        state = self.snapshot.load() if self.snapshot else None
+        if not state:
+            return False
+        for sheet_name, sheet in state['sheets'].items():
+            self.sheets.add(sheet_name)
+            self._set_field_indices(sheet_name, sheet['headers'])
+            self.cache[sheet_name] = sheet['cache']
+            self.row_numbers[sheet_name] = sheet['row_numbers']
+            self._rebuild_indexes(sheet_name)
+            self.versions[sheet_name] += 1
+            self.last_refreshed[sheet_name] = state['saved_at']
+            # Снимок отдаем сразу, а сверку с таблицей start() запустит в фоне
+            self.invalidate(sheet_name)
+        self._snapshot_versions = Counter(self.versions)
+        self._snapshot_saved = datetime.now()
+        logger.info(f"Restored {len(self.sheets)} sheets from cache snapshot saved at {state['saved_at']}")
+        return True
+
+    async def save_snapshot(self, force=False):
+        """Сохраняет кэш на диск, если он изменился и в нем нет неотправленных изменений.
+
+        Строки из очереди записи в снимок не попадают: они есть в журнале и
+        переиграются при старте, а в снимке их пришлось бы отличать от строк листа.
+        """
+        if not self.snapshot or self._pending_updates or self._pending_appends or any(self._inflight):
+            return
+        if self._snapshot_versions == self.versions:
+            return
+        if not force and datetime.now() - self._snapshot_saved < CACHE_SNAPSHOT_INTERVAL:
+            return
+        sheets = {
+            sheet_name: {
+                'headers': self.schemas.get(sheet_name).headers,
+                'cache': self.cache[sheet_name],
+                'row_numbers': self.row_numbers.get(sheet_name, {}),
+            }
+            for sheet_name in self.sheets if sheet_name in self.cache
+        }
+        versions = Counter(self.versions)
+        data = self.snapshot.dumps(sheets, max(self.last_refreshed.values(), default=datetime.now()))
+        try:
+            await self._run(self.snapshot.write, data)
+        except OSError as e:
+            logger.error(f"Failed to save cache snapshot: {e}")
+            return
+        self._snapshot_versions = versions
+        self._snapshot_saved = datetime.now()
+        logger.info(f"Saved cache snapshot of {len(sheets)} sheets ({len(data)} bytes)")
 
     def _init_field_indices(self, sheet_name):
-        headers = self.sheets[sheet_name].row_values(1)
-        self.field_indices[sheet_name] = {header: index for index, header in enumerate(headers) if header}
-        logger.info(f"Initialized field indices for sheet '{sheet_name}': {self.field_indices[sheet_name]}")
- 
-    def _cache_data(self):
-        for sheet_name, worksheet in self.sheets.items():
-            logger.info(f"Caching data for sheet: {sheet_name}")
-            all_data = worksheet.get_all_values()[1:]  # Пропускаем заголовки
-            if sheet_name == RATES_SHEET:
-                self.cache[sheet_name] = {
-                    (row[0], row[1]): row for row in all_data if len(row) > 1
-                }
-            else:
-                id_field = self.id_fields.get(sheet_name, 'id')
-                id_index = self.field_indices[sheet_name].get(id_field, 0)
-                self.cache[sheet_name] = {row[id_index]: row for row in all_data if len(row) > id_index}
-            self.cache_ttl[sheet_name] = datetime.now() + CACHE_TTL
-            logger.info(f"Cached {len(self.cache[sheet_name])} entries for sheet: {sheet_name}")
+        self.api_calls[(sheet_name, 'headers')] += 1
+        self._set_field_indices(sheet_name, self.backend.headers(sheet_name))
+
+    def _headers_usable(self, sheet_name, headers):
+        """Можно ли перейти на эти заголовки, не испортив строки кэша и очереди записи."""
+        current = self.schemas.get(sheet_name)
+        if current is None:
+            return True
+        if not any(headers):
+            # Пустая первая строка — скорее ошибка в таблице, чем новая раскладка: кэш не трогаем
+            logger.warning(f"Sheet '{sheet_name}' has no header row, keeping schema v{current.version}")
+            return False
+        required = [self.id_fields.get(sheet_name, 'id')] + self.index_fields.get(sheet_name, [])
+        missing = [field for field in required if field not in headers]
+        if missing:
+            logger.error(f"Sheet '{sheet_name}' has no required columns {missing}, keeping schema v{current.version}")
+            return False
+        return True
+
+    def _set_field_indices(self, sheet_name, headers):
+        """Обновляет схему листа. Возвращает True, если заголовки изменились."""
+        old = self.schemas.get(sheet_name)
+        if not self._headers_usable(sheet_name, headers) or not self.schemas.update(sheet_name, headers):
+            return False
+        schema = self.schemas.get(sheet_name)
+        self.field_indices[sheet_name] = schema.field_indices
+        if old is not None and old.field_indices != schema.field_indices:
+            self._remap_rows(sheet_name, old, schema)
+        logger.info(f"Schema v{schema.version} of sheet '{sheet_name}': {schema.field_indices}")
+        return True
+
+    def _remap_rows(self, sheet_name, old, new):
+        # Колонки переставили — переносим значения в кэше и в еще не отправленных строках.
+        # Строка очереди и строка кэша часто один и тот же список, поэтому собираем их по id
+        rows = {}
+        for source in (self.cache.get(sheet_name, {}), self._inflight[1].get(sheet_name, {}), self._pending_appends.get(sheet_name, {})):
+            for row in source.values():
+                rows[id(row)] = row
+        for row in rows.values():
+            row[:] = remap_row(row, old.field_indices, new.field_indices, new.width)
+        self.versions[sheet_name] += 1
+        logger.warning(f"Columns of sheet '{sheet_name}' changed, remapped {len(rows)} cached rows")
+
+    async def refresh_schema(self, sheet_name):
+        """Перечитывает строку заголовков листа. Возвращает True, если она изменилась."""
+        headers = await self._call(sheet_name, 'headers')
+        return self._set_field_indices(sheet_name, headers)
+
+    async def _check_layout(self, sheet_name):
+        """Сверяет заголовки и колонку id листа с кэшем перед записью.
+
+        Если колонки переставили — перестраивает строки кэша, если строки отсортировали
+        или удалили — заново строит номера строк по колонке id и перечитывает лист в фоне.
+        """
+        id_field = self.id_fields.get(sheet_name, 'id')
+        id_index = self.field_indices[sheet_name].get(id_field, 0)
+        headers, ids = await self._call(sheet_name, 'headers_and_column', id_index + 1)
+        if not self._headers_usable(sheet_name, headers):
+            # Писать по старой раскладке в лист, где ее больше нет, нельзя — пачка ждет в очереди
+            raise ValueError(f"Sheet '{sheet_name}' has unusable headers {headers}")
+        if self._set_field_indices(sheet_name, headers) and self.field_indices[sheet_name].get(id_field, 0) != id_index:
+            # Переехала сама колонка id — читаем ее с нового места
+            _, ids = await self._call(sheet_name, 'headers_and_column', self.field_indices[sheet_name].get(id_field, 0) + 1)
+        if sheet_name == RATES_SHEET:
+            return  # Строки курсов определяются парой колонок, а бот их не меняет
+
+        row_numbers = self.row_numbers.get(sheet_name, {})
+        if all(row_number - 2 < len(ids) and ids[row_number - 2] == id_value for id_value, row_number in row_numbers.items()):
+            return
+        logger.warning(f"Rows of sheet '{sheet_name}' were moved or deleted, re-indexing row numbers")
+        row_numbers = {}
+        for row_number, id_value in enumerate(ids, start=2):
+            if id_value:
+                row_numbers.setdefault(id_value, row_number)
+        self.row_numbers[sheet_name] = row_numbers
+        self.invalidate(sheet_name)
+
+    async def refresh_schemas(self):
+        """Сверяет заголовки всех листов с таблицей и возвращает имена измененных."""
+        return [sheet_name for sheet_name in sorted(self.sheets) if await self.refresh_schema(sheet_name)]
+
+    async def _refresher_loop(self):
+        # Фоновое обновление: читатели всегда получают последний удачный снимок,
+        # а перезагрузка листов идет по расписанию
+        while True:
+            await asyncio.sleep(self._seconds_until_next_refresh())
+            for sheet_name in list(self.sheets):
+                if not self._is_expired(sheet_name):
+                    continue
+                try:
+                    await self._refresh_sheet(sheet_name)
+                except Exception as e:
+                    # Ошибка одного листа не должна останавливать обновление остальных
+                    logger.error(f"Failed to refresh sheet '{sheet_name}': {e}", exc_info=True)
+                    self.cache_ttl[sheet_name] = datetime.now() + CACHE_RETRY_INTERVAL
+
+    def _seconds_until_next_refresh(self):
+        now = datetime.now()
+        next_refresh = min(self.cache_ttl.values(), default=now + CACHE_UPDATE_INTERVAL)
+        next_refresh = min(next_refresh, now + CACHE_UPDATE_INTERVAL)
+        return max((next_refresh - now).total_seconds(), 1)
+
+    def _refresh_sheet(self, sheet_name):
+        # Одновременные запросы на обновление листа ждут одну и ту же загрузку
+        task = self._refresh_tasks.get(sheet_name)
+        if task is None or task.done():
+            task = asyncio.create_task(self._reload_sheet(sheet_name))
+            self._refresh_tasks[sheet_name] = task
+        return task
+
+    async def _reload_sheet(self, sheet_name):
+        logger.info(f"Caching data for sheet: {sheet_name}")
+        flush_generation = self._flush_generation
+        try:
+            all_values = await self._call(sheet_name, 'get_all_values')
+        except Exception as e:
+            logger.error(f"Failed to refresh sheet '{sheet_name}', serving cached data: {e}")
+            self.cache_ttl[sheet_name] = datetime.now() + CACHE_RETRY_INTERVAL
+            return
+        if not self._store_sheet_values(sheet_name, all_values):
+            self.cache_ttl[sheet_name] = datetime.now() + CACHE_RETRY_INTERVAL
+            return
+        if flush_generation != self._flush_generation:
+            # Пока лист загружался, в него записали пачку — снимок мог ее не увидеть
+            self.invalidate(sheet_name)
+
+    async def _ensure_fresh(self, sheet_name):
+        if not self._is_expired(sheet_name):
+            return
+        task = self._refresh_sheet(sheet_name)
+        if sheet_name not in self.cache:
+            await asyncio.shield(task)
+
+    def _is_expired(self, sheet_name):
+        return datetime.now() > self.cache_ttl.get(sheet_name, datetime.min)
+
+    def invalidate(self, sheet_name):
+        self.cache_ttl[sheet_name] = datetime.min
+
+    def _store_sheet_values(self, sheet_name, all_values):
+        """Кладет значения листа в кэш. Возвращает False, если заголовки не подошли и кэш не тронут."""
+        # Колонки могли поменяться, пока бот работал из снимка или без связи с таблицей
+        headers = all_values[0] if all_values else []
+        if not self._headers_usable(sheet_name, headers):
+            return False
+        self._set_field_indices(sheet_name, headers)
+        all_data = all_values[1:]  # Пропускаем заголовки
+        cache = {}
+        row_numbers = {}
+        for row_number, row in enumerate(all_data, start=2):
+            key = self._row_key(sheet_name, row)
+            if key is not None:
+                cache[key] = row
+                row_numbers[key] = row_number
+        self.cache[sheet_name] = cache
+        self.row_numbers[sheet_name] = row_numbers
+        self._apply_pending(sheet_name)
+        self._rebuild_indexes(sheet_name)
+        self.versions[sheet_name] += 1
+        for listener in self.reload_listeners:
+            listener(sheet_name)
+        self.last_refreshed[sheet_name] = datetime.now()
+        self.cache_ttl[sheet_name] = self.last_refreshed[sheet_name] + CACHE_TTLS.get(sheet_name, CACHE_TTL)
+        logger.info(f"Cached {len(self.cache[sheet_name])} entries for sheet: {sheet_name}")
+        return True
+
+    def _row_key(self, sheet_name, row):
+        if sheet_name == RATES_SHEET:
+            return (row[0], row[1]) if len(row) > 1 and (row[0] or row[1]) else None
+        id_field = self.id_fields.get(sheet_name, 'id')
+        id_index = self.field_indices[sheet_name].get(id_field, 0)
+        return row[id_index] if len(row) > id_index and row[id_index] else None
+
+    async def _find_row_number(self, sheet_name, id_value):
+        row_number = self.row_numbers.get(sheet_name, {}).get(id_value)
+        if row_number is not None:
+            return row_number
+
+        # Записи нет в индексе — ищем только в колонке id и запоминаем результат
+        id_field = self.id_fields.get(sheet_name, 'id')
+        id_index = self.field_indices[sheet_name].get(id_field, 0)
+        row_number = await self._call(sheet_name, 'find', id_value, id_index + 1)
+        if not row_number:
+            return None
+        self.row_numbers.setdefault(sheet_name, {})[id_value] = row_number
+        return row_number
+
+    def _index_appended_rows(self, sheet_name, keys, first_row):
+        if first_row is None:
+            logger.warning(f"Could not read appended range for sheet '{sheet_name}', row numbers will be looked up on demand")
+            return
+        row_numbers = self.row_numbers.setdefault(sheet_name, {})
+        for offset, key in enumerate(keys):
+            row_numbers[key] = first_row + offset
+
+    def _rebuild_indexes(self, sheet_name):
+        self.indexes[sheet_name] = {field: {} for field in self.index_fields.get(sheet_name, [])}
+        for id_value, row in self.cache[sheet_name].items():
+            self._index_row(sheet_name, id_value, row)
+
+    def _indexed_values(self, sheet_name, row):
+        values = {}
+        for field in self.indexes.get(sheet_name, {}):
+            index = self.field_indices[sheet_name].get(field)
+            values[field] = row[index] if index is not None and index < len(row) else None
+        return values
+
+    def _index_row(self, sheet_name, id_value, row):
+        for field, value in self._indexed_values(sheet_name, row).items():
+            self.indexes[sheet_name][field].setdefault(value, {})[id_value] = None
+
+    def _unindex_row(self, sheet_name, id_value, row):
+        for field, value in self._indexed_values(sheet_name, row).items():
+            bucket = self.indexes[sheet_name][field].get(value)
+            if bucket is not None:
+                bucket.pop(id_value, None)
+                if not bucket:
+                    del self.indexes[sheet_name][field][value]
+
+    def _put_row(self, sheet_name, id_value, row):
+        old_row = self.cache[sheet_name].get(id_value)
+        if old_row is not None:
+            self._unindex_row(sheet_name, id_value, old_row)
+        self.cache[sheet_name][id_value] = row
+        self._index_row(sheet_name, id_value, row)
+        self.versions[sheet_name] += 1
+
+    async def query(self, sheet_name, filters, fields=None):
+        """Возвращает записи, у которых поля совпадают с filters.
+
+        Значение фильтра может быть списком допустимых значений. Поля из index_fields
+        отбираются по индексу, остальные проверяются только среди найденных записей.
+        fields ограничивает набор полей в возвращаемых строках.
+        """
+        if sheet_name not in self.sheets:
+            raise ValueError(f"Sheet '{sheet_name}' not found")
 
-    def get_data(self, sheet_name, id_value=None):
+        await self._ensure_fresh(sheet_name)
+
+        filters = {field: set(value) if isinstance(value, (list, tuple, set)) else {value}
+                   for field, value in filters.items()}
+        indexes = self.indexes.get(sheet_name, {})
+        indexed = [field for field in filters if field in indexes]
+
+        if indexed:
+            # Начинаем с самого селективного индекса и сужаем остальными
+            buckets = {field: [indexes[field].get(value, {}) for value in filters[field]] for field in indexed}
+            indexed.sort(key=lambda field: sum(len(bucket) for bucket in buckets[field]))
+            leading = indexed[0]
+            candidates = {}
+            for bucket in buckets[leading]:
+                candidates.update(bucket)
+            for field in indexed[1:]:
+                candidates = {id_value: None for id_value in candidates
+                              if any(id_value in bucket for bucket in buckets[field])}
+            # Возвращаем записи в порядке строк листа, еще не отправленные — в конце в порядке добавления
+            row_numbers = self.row_numbers.get(sheet_name, {})
+            unsent = {}
+            for appends in (self._inflight[1].get(sheet_name, {}), self._pending_appends.get(sheet_name, {})):
+                for id_value in appends:
+                    unsent.setdefault(id_value, len(unsent))
+            candidates = sorted(candidates, key=lambda id_value: (row_numbers.get(id_value, float('inf')), unsent.get(id_value, 0)))
+        else:
+            candidates = self.cache[sheet_name]
+
+        results = []
+        for id_value in candidates:
+            row = self.cache[sheet_name].get(id_value)
+            if row is None:
+                continue
+            row_data = self._row_view(sheet_name, row)
+            if all(row_data.get(field) in values for field, values in filters.items()):
+                results.append(self._row_view(sheet_name, row, fields) if fields else row_data)
+        return results
+
+    async def get_data(self, sheet_name, id_value=None, fields=None):
         logger.info(f"Getting data from sheet: {sheet_name}, id_value: {id_value}")
         if sheet_name not in self.sheets:
             raise ValueError(f"Sheet '{sheet_name}' not found")
 
-        if datetime.now() > self.cache_ttl.get(sheet_name, datetime.min):
-            self._cache_data()
+        await self._ensure_fresh(sheet_name)
 
         if sheet_name == RATES_SHEET:
             if id_value is None:
-                return [self._format_row_data(sheet_name, row) for row in self.cache[sheet_name].values()]
+                return [self._row_view(sheet_name, row, fields) for row in self.cache[sheet_name].values()]
             elif isinstance(id_value, tuple) and len(id_value) == 2:
                 data = self.cache[sheet_name].get(id_value)
-                return self._format_row_data(sheet_name, data) if data else None
+                return self._row_view(sheet_name, data, fields) if data else None
             else:
-                return [self._format_row_data(sheet_name, row) for row in self.cache[sheet_name].values()
+                return [self._row_view(sheet_name, row, fields) for row in self.cache[sheet_name].values()
                         if row[0] == id_value or row[1] == id_value]
         else:
             if id_value is None:
-                return [self._format_row_data(sheet_name, row) for row in self.cache[sheet_name].values()]
+                return [self._row_view(sheet_name, row, fields) for row in self.cache[sheet_name].values()]
             data = self.cache[sheet_name].get(id_value)
-            return self._format_row_data(sheet_name, data) if data else None
+            return self._row_view(sheet_name, data, fields) if data else None
 
-    def _format_row_data(self, sheet_name, row_data):
-        if not row_data:
-            return {}
-        result = {}
-        for field, index in self.field_indices[sheet_name].items():
-            if index < len(row_data):
-                result[field] = row_data[index]
-            else:
-                result[field] = None
-        return result
+    async def count(self, sheet_name):
+        if sheet_name not in self.sheets:
+            raise ValueError(f"Sheet '{sheet_name}' not found")
+
+        await self._ensure_fresh(sheet_name)
+        return len(self.cache[sheet_name])
 
-    def update_data(self, sheet_name, id_value, updated_data):
+    async def ids(self, sheet_name):
+        """Множество id записей листа (представление ключей кэша) для проверки за O(1)."""
         if sheet_name not in self.sheets:
             raise ValueError(f"Sheet '{sheet_name}' not found")
 
-        id_field = self.id_fields.get(sheet_name, 'id')
-        id_index = self.field_indices[sheet_name].get(id_field, 0)
+        await self._ensure_fresh(sheet_name)
+        return self.cache[sheet_name].keys()
 
-        if id_value not in self.cache[sheet_name]:
-            row = self.sheets[sheet_name].find(str(id_value), in_column=id_index + 1)
-            if row:
-                self.cache[sheet_name][id_value] = self.sheets[sheet_name].row_values(row.row)
+    async def move_entries(self, sheet_name, target_sheet, select):
+        """Переносит записи листа, для которых select(запись) истинно, в конец листа target_sheet.
+
+        Лист перечитывается прямо перед переносом, чтобы номера удаляемых строк были
+        актуальны, а записи с неотправленными изменениями не трогаются. Строки сначала
+        дописываются в target_sheet и только потом удаляются: после сбоя между шагами
+        запись может оказаться в обоих листах, но не пропадет. Возвращает перенесенные записи.
+        """
+        if sheet_name not in self.sheets:
+            raise ValueError(f"Sheet '{sheet_name}' not found")
+
+        await self.flush()
+        async with self._flush_lock:
+            all_values = await self._call(sheet_name, 'get_all_values')
+            if not self._store_sheet_values(sheet_name, all_values):
+                return []
+            row_numbers = self.row_numbers[sheet_name]
+            pending = (self._pending_updates.get(sheet_name, {}), self._pending_appends.get(sheet_name, {}))
+            moved = {}  # id -> номер строки на момент чтения листа
+            for id_value, row in self.cache[sheet_name].items():
+                if id_value not in row_numbers or any(id_value in queue for queue in pending):
+                    continue
+                if select(self._row_view(sheet_name, row)):
+                    moved[id_value] = row_numbers[id_value]
+            if not moved:
+                return []
+
+            await self._cold_schema(target_sheet)
+            source_fields = self.field_indices[sheet_name]
+            target_fields = self.field_indices[target_sheet]
+            rows = []
+            for id_value in sorted(moved, key=moved.get):
+                source_row = self.cache[sheet_name][id_value]
+                row = [''] * (max(target_fields.values(), default=-1) + 1)
+                for field, index in target_fields.items():
+                    source_index = source_fields.get(field)
+                    if source_index is not None and source_index < len(source_row):
+                        row[index] = source_row[source_index]
+                rows.append(row)
+            await self._call(target_sheet, 'append_rows', rows)
+
+            # Пока строки дописывались в архив, лист могли отсортировать или изменить вручную:
+            # номера удаляемых строк заново сверяются с колонкой id, как перед записью пачки
+            await self._check_layout(sheet_name)
+            row_numbers = self.row_numbers[sheet_name]
+            delete_rows = sorted(row_numbers[id_value] for id_value in moved if id_value in row_numbers)
+            if delete_rows:
+                await self._call(sheet_name, 'delete_rows', delete_rows)
+            if all(row_numbers.get(id_value) == row_number for id_value, row_number in moved.items()):
+                deleted = set(delete_rows)
+                self._store_sheet_values(sheet_name, [
+                    values for row_number, values in enumerate(all_values, start=1) if row_number not in deleted
+                ])
             else:
-                self.cache[sheet_name][id_value] = [''] * len(self.field_indices[sheet_name])
+                self._store_sheet_values(sheet_name, await self._call(sheet_name, 'get_all_values'))
+        logger.info(f"Moved {len(rows)} entries from sheet '{sheet_name}' to '{target_sheet}'")
+        return [self._row_view(target_sheet, row) for row in rows]
 
-        row_data = self.cache[sheet_name][id_value]
-        cells_to_update = []
-        for field, value in updated_data.items():
-            if field in self.field_indices[sheet_name]:
-                index = self.field_indices[sheet_name][field]
-                row_data[index] = value
-                cells_to_update.append(gspread.Cell(row.row, index + 1, value))
+    async def _cold_schema(self, sheet_name):
+        # Заголовки холодного листа читаются один раз; если листа нет, он создается
+        if sheet_name not in self.field_indices:
+            headers = await self._call(sheet_name, 'ensure_sheet', SHEET_HEADERS[sheet_name])
+            self._set_field_indices(sheet_name, headers)
 
-        if cells_to_update:
-            self.sheets[sheet_name].update_cells(cells_to_update)
-        self.cache[sheet_name][id_value] = row_data
+    async def find_cold_entry(self, sheet_name, id_value):
+        """Ищет запись холодного листа по id прямо в хранилище."""
+        await self._cold_schema(sheet_name)
+        id_index = self.field_indices[sheet_name].get(self.id_fields[sheet_name], 0)
+        row_number = await self._call(sheet_name, 'find', id_value, id_index + 1)
+        if not row_number:
+            return None
+        return self._row_view(sheet_name, await self._call(sheet_name, 'row_values', row_number))
 
-    def add_new_entry(self, sheet_name, data):
-        logger.info(f"Adding new entry to sheet: {sheet_name}")
+    async def get_cold_entries(self, sheet_name):
+        """Все записи холодного листа; в кэш они не попадают."""
+        await self._cold_schema(sheet_name)
+        all_values = await self._call(sheet_name, 'get_all_values')
+        if all_values:
+            self._set_field_indices(sheet_name, all_values[0])
+        return [self._row_view(sheet_name, row) for row in all_values[1:] if any(row)]
+
+    async def get_derived(self, sheet_name, name, build, filters=None):
+        """Возвращает build(записи листа), пересчитывая значение только после изменения листа.
+
+        filters, как в query, ограничивает записи, из которых строится значение.
+        """
         if sheet_name not in self.sheets:
             raise ValueError(f"Sheet '{sheet_name}' not found")
 
-        id_field = self.id_fields.get(sheet_name, 'id')
-        if id_field not in data:
-            raise ValueError(f"'{id_field}' must be provided in the data")
+        await self._ensure_fresh(sheet_name)
+        cached = self._derived.get((sheet_name, name))
+        if cached is None or cached[0] != self.versions[sheet_name]:
+            rows = await self.query(sheet_name, filters) if filters else await self.get_data(sheet_name)
+            cached = (self.versions[sheet_name], build(rows))
+            self._derived[(sheet_name, name)] = cached
+        return cached[1]
 
-        # Получаем актуальные заголовки таблицы
-        headers = self.sheets[sheet_name].row_values(1)
-        
-        # Обновляем field_indices
-        self.field_indices[sheet_name] = {header: index for index, header in enumerate(headers) if header}
+    def _row_view(self, sheet_name, row_data, fields=None):
+        if not row_data:
+            return {}
+        return RowView(self._schema(sheet_name, fields), row_data)
+
+    def _schema(self, sheet_name, fields=None):
+        field_indices = self.field_indices[sheet_name]
+        if fields is None:
+            return field_indices
+        key = (sheet_name, tuple(fields))
+        schema = self._projections.get(key)
+        # Схема проекции устаревает, если заголовки листа перечитали
+        if schema is None or schema[0] is not field_indices:
+            schema = (field_indices, {field: field_indices[field] for field in fields if field in field_indices})
+            self._projections[key] = schema
+        return schema[1]
+
+    async def update_data(self, sheet_name, id_value, updated_data):
+        if sheet_name not in self.sheets:
+            raise ValueError(f"Sheet '{sheet_name}' not found")
+
+        if id_value not in self.cache[sheet_name]:
+            row_number = await self._find_row_number(sheet_name, id_value)
+            if row_number:
+                self._put_row(sheet_name, id_value, await self._call(sheet_name, 'row_values', row_number))
+            else:
+                # Строки нет на листе — сохраняем значения только в кэше, как и раньше
+                row_data = [''] * self.schemas.get(sheet_name).width
+                for field, value in updated_data.items():
+                    if field in self.field_indices[sheet_name]:
+                        row_data[self.field_indices[sheet_name][field]] = value
+                self._put_row(sheet_name, id_value, row_data)
+                return
 
-        new_row = [''] * len(headers)
+        await self.batch_update(sheet_name, id_value, updated_data)
+
+    def _build_row(self, sheet_name, data):
+        new_row = [''] * self.schemas.get(sheet_name).width
         for field, value in data.items():
             if field in self.field_indices[sheet_name]:
                 if field in ['USER_ID', 'AMOUNT', 'RESULT']:
                     value = str(value).lstrip("'")
-                new_row[self.field_indices[sheet_name][field]] = str(value)            
-            if field in self.field_indices[sheet_name]:
                 new_row[self.field_indices[sheet_name][field]] = str(value)
             else:
                 logger.warning(f"Field '{field}' not found in sheet '{sheet_name}'. Skipping.")
+        return new_row
+
+    async def add_new_entry(self, sheet_name, data):
+        logger.info(f"Adding new entry to sheet: {sheet_name}")
+        if sheet_name not in self.sheets:
+            raise ValueError(f"Sheet '{sheet_name}' not found")
 
-        self.sheets[sheet_name].append_row(new_row)
-        self.cache[sheet_name][data[id_field]] = new_row
+        id_field = self.id_fields.get(sheet_name, 'id')
+        if id_field not in data:
+            raise ValueError(f"'{id_field}' must be provided in the data")
+
+        self._queue_append(sheet_name, data[id_field], data)
         logger.info(f"New entry added: {data[id_field]}")
         return data[id_field]
 
-    def batch_update(self, sheet_name, id_value, updated_data):
+    async def batch_update(self, sheet_name, id_value, updated_data):
         logger.info(f"Batch updating sheet: {sheet_name}, id: {id_value}")
         if sheet_name not in self.sheets:
             raise ValueError(f"Sheet '{sheet_name}' not found")
 
-        row = self.sheets[sheet_name].find(str(id_value))
-        if not row:
-            raise ValueError(f"Entry with id {id_value} not found in sheet {sheet_name}")
+        if id_value not in self.cache[sheet_name]:
+            if not await self._find_row_number(sheet_name, id_value):
+                raise ValueError(f"Entry with id {id_value} not found in sheet {sheet_name}")
+            # Строка есть в таблице, но не в кэше — лист изменили извне
+            self.invalidate(sheet_name)
 
-        cells_to_update = []
+        updated_data = {field: str(value) for field, value in updated_data.items() if field in self.field_indices[sheet_name]}
+        if not updated_data:
+            return
+
+        self.wal.append({'op': 'update', 'sheet': sheet_name, 'id': id_value, 'data': updated_data})
+        self._merge_update(sheet_name, id_value, updated_data)
+        logger.info(f"Queued update of {len(updated_data)} cells for id: {id_value}")
+
+    async def batch_add_entries(self, sheet_name, entries):
+        id_field = self.id_fields[sheet_name]
+        for entry in entries:
+            self._queue_append(sheet_name, entry[id_field], entry)
+
+    def _queue_append(self, sheet_name, id_value, data):
+        data = {field: str(value) for field, value in data.items()}
+        self.wal.append({'op': 'append', 'sheet': sheet_name, 'id': id_value, 'data': data})
+        new_row = self._build_row(sheet_name, data)
+        self._pending_appends.setdefault(sheet_name, {})[id_value] = new_row
+        self._put_row(sheet_name, id_value, new_row)
+
+    def _merge_update(self, sheet_name, id_value, updated_data):
+        row = self.cache[sheet_name].get(id_value)
+        if row is not None:
+            self._unindex_row(sheet_name, id_value, row)
+            self._set_fields(sheet_name, row, updated_data)
+            self._index_row(sheet_name, id_value, row)
+            self.versions[sheet_name] += 1
+
+        pending_row = self._pending_appends.get(sheet_name, {}).get(id_value)
+        if pending_row is not None:
+            # Строка еще не отправлена — достаточно изменить ее саму
+            if pending_row is not row:
+                self._set_fields(sheet_name, pending_row, updated_data)
+            return
+        self._pending_updates.setdefault(sheet_name, {}).setdefault(id_value, {}).update(updated_data)
+
+    def _set_fields(self, sheet_name, row, updated_data):
         for field, value in updated_data.items():
-            if field in self.field_indices[sheet_name]:
-                col = self.field_indices[sheet_name][field] + 1
-                cells_to_update.append(gspread.Cell(row.row, col, str(value)))
+            index = self.field_indices[sheet_name].get(field)
+            if index is None:
+                continue
+            if index >= len(row):
+                row.extend([''] * (index + 1 - len(row)))
+            row[index] = value
 
-        if cells_to_update:
-            self.sheets[sheet_name].update_cells(cells_to_update)
-            
-        # Обновляем кэш
-        if id_value in self.cache[sheet_name]:
-            for field, value in updated_data.items():
-                if field in self.field_indices[sheet_name]:
-                    self.cache[sheet_name][id_value][self.field_indices[sheet_name][field]] = str(value)
+    def _apply_pending(self, sheet_name):
+        # После перезагрузки листа возвращаем в кэш изменения, которые еще не дошли до Sheets
+        inflight_updates, inflight_appends = self._inflight
+        for appends in (inflight_appends.get(sheet_name, {}), self._pending_appends.get(sheet_name, {})):
+            for id_value, row in appends.items():
+                if id_value not in self.cache[sheet_name]:
+                    self.cache[sheet_name][id_value] = row
+        for updates in (inflight_updates.get(sheet_name, {}), self._pending_updates.get(sheet_name, {})):
+            for id_value, updated_data in updates.items():
+                row = self.cache[sheet_name].get(id_value)
+                if row is not None:
+                    self._set_fields(sheet_name, row, updated_data)
+
+    def _replay_write_ahead_log(self):
+        records = self.wal.replay()
+        for record in records:
+            sheet_name = record.get('sheet')
+            if sheet_name not in self.sheets:
+                logger.warning(f"Skipping write-ahead log record for unknown sheet: {record}")
+                continue
+            if record['op'] == 'append' and record['id'] not in self.cache[sheet_name]:
+                new_row = self._build_row(sheet_name, record['data'])
+                self._pending_appends.setdefault(sheet_name, {})[record['id']] = new_row
+                self._put_row(sheet_name, record['id'], new_row)
+            else:
+                # Строка уже есть на листе (пачка была отправлена до падения) — повторяем как обновление
+                updated_data = {field: value for field, value in record['data'].items() if field in self.field_indices[sheet_name]}
+                self._merge_update(sheet_name, record['id'], updated_data)
+        if records:
+            logger.info(f"Replayed {len(records)} write-ahead log records")
 
-        logger.info(f"Updated {len(cells_to_update)} cells for id: {id_value}")
+    async def _flusher_loop(self):
+        while True:
+            await asyncio.sleep(WRITE_BEHIND_INTERVAL.total_seconds())
+            if await self.flush():
+                await self.sync_mirror()
+            await self.save_snapshot()
 
+    async def sync_mirror(self, force=False):
+        """Сверяет локальную базу с Google Sheets не чаще раза в MIRROR_SYNC_INTERVAL."""
+        if not self.mirror or (not force and datetime.now() - self._mirror_synced < MIRROR_SYNC_INTERVAL):
+            return
+        self._mirror_synced = datetime.now()
+        for sheet_name in list(self.sheets):
+            try:
+                if await self._run(self.mirror.sync, sheet_name):
+                    # В локальную базу попали правки из таблицы, возможно и новые колонки
+                    self._init_field_indices(sheet_name)
+                    await self._refresh_sheet(sheet_name)
+            except Exception as e:
+                logger.error(f"Failed to sync sheet '{sheet_name}' with Google Sheets: {e}")
 
-    def batch_add_entries(self, sheet_name, entries):
-        worksheet = self.sheets[sheet_name]
-        rows_to_add = []
-        for entry in entries:
-            new_row = [''] * len(self.field_indices[sheet_name])
-            for field, value in entry.items():
-                if field in self.field_indices[sheet_name]:
-                    new_row[self.field_indices[sheet_name][field]] = value
-            rows_to_add.append(new_row)
-        
-        worksheet.append_rows(rows_to_add)
-        
-        for entry in entries:
-            id_field = self.id_fields[sheet_name]
-            self.cache[sheet_name][entry[id_field]] = new_row
+    async def flush(self):
+        """Отправляет накопленные изменения в Google Sheets. Возвращает False, если часть осталась в очереди."""
+        async with self._flush_lock:
+            # Один fsync журнала на пачку вместо fsync на каждое изменение; не в пуле
+            # Sheets, чтобы не ждать за медленными запросами к API
+            await asyncio.get_running_loop().run_in_executor(None, self.wal.sync)
+            if not self._pending_updates and not self._pending_appends:
+                return True
+
+            try:
+                # Перестановка колонок или строк не приводит к ошибке записи, поэтому раскладка листов
+                # с изменениями сверяется перед каждой пачкой: одно чтение на лист раз в WRITE_BEHIND_INTERVAL
+                for sheet_name in set(self._pending_updates) | set(self._pending_appends):
+                    await self._check_layout(sheet_name)
+            except Exception as e:
+                logger.error(f"Failed to check sheet layout, will retry: {e}")
+                return False
+
+            self.wal.rotate()
+            updates, self._pending_updates = self._pending_updates, {}
+            appends, self._pending_appends = self._pending_appends, {}
+            self._inflight = (updates, appends)
+            try:
+                for sheet_name in list(appends):
+                    await self._flush_appends(sheet_name, appends[sheet_name])
+                    del appends[sheet_name]
+                for sheet_name in list(updates):
+                    await self._flush_updates(sheet_name, updates[sheet_name])
+                    del updates[sheet_name]
+            except Exception as e:
+                logger.error(f"Failed to flush changes to Google Sheets, will retry: {e}")
+                self._requeue(updates, appends)
+                return False
+            finally:
+                self._inflight = ({}, {})
+
+            self._flush_generation += 1
+            self.wal.commit()
+            return True
+
+    async def _flush_appends(self, sheet_name, appends):
+        keys = list(appends)
+        rows = [self.cache[sheet_name].get(id_value, appends[id_value]) for id_value in keys]
+        first_row = await self._call(sheet_name, 'append_rows', rows)
+        self._index_appended_rows(sheet_name, keys, first_row)
+        logger.info(f"Flushed {len(rows)} new rows to sheet: {sheet_name}")
+
+    async def _flush_updates(self, sheet_name, updates):
+        cells_to_update = []
+        for id_value, updated_data in updates.items():
+            row_number = await self._find_row_number(sheet_name, id_value)
+            if not row_number:
+                logger.error(f"Entry with id {id_value} not found in sheet {sheet_name}, dropping update {updated_data}")
+                continue
+            for field, value in updated_data.items():
+                if field not in self.field_indices[sheet_name]:
+                    logger.error(f"Column '{field}' was removed from sheet {sheet_name}, dropping update of id {id_value}")
+                    continue
+                col = self.field_indices[sheet_name][field] + 1
+                cells_to_update.append((row_number, col, value))
+
+        if cells_to_update:
+            await self._call(sheet_name, 'update_cells', cells_to_update)
+        logger.info(f"Flushed {len(cells_to_update)} cells to sheet: {sheet_name}")
+
+    def _requeue(self, updates, appends):
+        # Неотправленная пачка старше всего, что накопилось за время отправки
+        for sheet_name, sheet_appends in appends.items():
+            merged = dict(sheet_appends)
+            merged.update(self._pending_appends.get(sheet_name, {}))
+            self._pending_appends[sheet_name] = merged
+        for sheet_name, sheet_updates in updates.items():
+            pending = self._pending_updates.setdefault(sheet_name, {})
+            for id_value, updated_data in sheet_updates.items():
+                if id_value in self._pending_appends.get(sheet_name, {}):
+                    self._set_fields(sheet_name, self._pending_appends[sheet_name][id_value], updated_data)
+                    continue
+                merged = dict(updated_data)
+                merged.update(pending.get(id_value, {}))
+                pending[id_value] = merged
 
-    def get_multiple_data(self, sheet_name, id_values, fields=None):
-        if datetime.now() > self.cache_ttl.get(sheet_name, datetime.min):
-            self._cache_data(sheet_name)
+    async def get_multiple_data(self, sheet_name, id_values, fields=None):
+        await self._ensure_fresh(sheet_name)
         
         results = []
         for id_value in id_values:
             data = self.cache[sheet_name].get(id_value)
             if data:
-                results.append(self._format_row_data(sheet_name, data, fields))
+                results.append(self._row_view(sheet_name, data, fields))
         
-        return results
\ No newline at end of file
+        return results
@@ -0,0 +1,96 @@
+import logging
+import random
+import threading
+import time
+from collections import Counter
+from http import HTTPStatus
+
+from gspread.exceptions import APIError
+from gspread.http_client import HTTPClient
+from requests.exceptions import ConnectionError, Timeout
+
+from config import (
+    SHEETS_READ_QUOTA_PER_MINUTE, SHEETS_WRITE_QUOTA_PER_MINUTE,
+    SHEETS_MAX_RETRIES, SHEETS_BACKOFF_BASE, SHEETS_BACKOFF_MAX
+)
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """Потокобезопасный token bucket: не больше `rate_per_minute` запросов в минуту."""
+
+    def __init__(self, rate_per_minute):
+        self.capacity = rate_per_minute
+        self.rate = rate_per_minute / 60
+        self.tokens = float(rate_per_minute)
+        self.updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Берет токен, при необходимости ожидая. Возвращает время ожидания в секундах."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+            self.updated_at = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+class QuotaAwareHTTPClient(HTTPClient):
+    """HTTP-клиент gspread с ограничением частоты запросов и повторами.
+
+    Чтение и запись ограничиваются отдельными token bucket'ами по квотам Sheets API,
+    ответы 429 и 5xx повторяются с экспоненциальной задержкой и случайным разбросом.
+    Запись (например, values:append) не идемпотентна: после таймаута или 5xx она могла
+    уже выполниться, поэтому повторяется только 429 — такой запрос Google отклоняет
+    до выполнения.
+    Вызывается из пула потоков SheetManager, поэтому ожидание блокирует только поток.
+    """
+
+    _RETRY_STATUSES = {HTTPStatus.TOO_MANY_REQUESTS, HTTPStatus.REQUEST_TIMEOUT}
+
+    def __init__(self, auth, session=None):
+        super().__init__(auth, session)
+        self.buckets = {
+            'read': TokenBucket(SHEETS_READ_QUOTA_PER_MINUTE),
+            'write': TokenBucket(SHEETS_WRITE_QUOTA_PER_MINUTE),
+        }
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key, value=1):
+        with self._stats_lock:
+            self.stats[key] += value
+
+    def request(self, method, endpoint, *args, **kwargs):
+        idempotent = method.upper() == 'GET'
+        kind = 'read' if idempotent else 'write'
+        for attempt in range(SHEETS_MAX_RETRIES + 1):
+            waited = self.buckets[kind].acquire()
+            if waited:
+                self._count(f'{kind}_throttled_seconds', waited)
+            self._count(f'{kind}_requests')
+            try:
+                return super().request(method, endpoint, *args, **kwargs)
+            except APIError as e:
+                if attempt == SHEETS_MAX_RETRIES or not self._should_retry(e.code, idempotent):
+                    self._count('errors')
+                    raise
+                error = e
+            except (ConnectionError, Timeout) as e:
+                if attempt == SHEETS_MAX_RETRIES or not idempotent:
+                    self._count('errors')
+                    raise
+                error = e
+            delay = min(SHEETS_BACKOFF_MAX, SHEETS_BACKOFF_BASE * 2 ** attempt)
+            delay = random.uniform(delay / 2, delay)
+            self._count('retries')
+            logger.warning(f"Sheets API {method} failed ({error}), retry {attempt + 1}/{SHEETS_MAX_RETRIES} in {delay:.1f}s")
+            time.sleep(delay)
+
+    def _should_retry(self, code, idempotent):
+        if not idempotent:
+            return code == HTTPStatus.TOO_MANY_REQUESTS
+        return code in self._RETRY_STATUSES or code >= HTTPStatus.INTERNAL_SERVER_ERROR
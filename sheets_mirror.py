@@ -0,0 +1,105 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+class SheetsMirror:
+    """Синхронизирует локальную базу SQLite с зеркалом в Google Sheets.
+
+    Строки, измененные ботом (_dirty > 0), отправляются в таблицу. Остальные строки
+    принимают правки администраторов из таблицы: изменения, новые строки и удаления.
+    Если строку одновременно изменили и бот, и администратор, побеждает бот.
+    Все методы блокирующие и вызываются из пула потоков SheetManager.
+    """
+
+    def __init__(self, store, sheets, key_fields):
+        self.store = store
+        self.sheets = sheets
+        self.key_fields = key_fields  # лист -> поля, однозначно определяющие строку
+
+    def _key(self, sheet_name, headers, row):
+        values = []
+        for field in self.key_fields[sheet_name]:
+            index = headers.index(field) if field in headers else None
+            values.append(row[index] if index is not None and index < len(row) else '')
+        return tuple(values) if any(values) else None
+
+    def sync(self, sheet_name):
+        """Возвращает True, если в локальную базу попали правки из таблицы."""
+        if sheet_name not in self.sheets.worksheets:
+            return False
+
+        mirror_values = self.sheets.get_all_values(sheet_name)
+        if not mirror_values:
+            return False
+        mirror_headers = mirror_values[0]
+        self.store.ensure_columns(sheet_name, mirror_headers)
+        headers = self.store.headers(sheet_name)
+        mirror_columns = {header: col for col, header in enumerate(mirror_headers, start=1) if header}
+
+        mirror_rows = {}
+        for row_number, row in enumerate(mirror_values[1:], start=2):
+            key = self._key(sheet_name, mirror_headers, row)
+            if key is not None:
+                mirror_rows[key] = (row_number, row)
+
+        cells_to_push = []
+        rows_to_push = []
+        pushed_versions = {}
+        pulled_updates = {}
+        pulled_deletes = []
+        seen = set()
+        for local_row, dirty, values in self.store.rows_with_state(sheet_name):
+            key = self._key(sheet_name, headers, values)
+            if key is None:
+                continue
+            seen.add(key)
+            mirror_row_number, mirror_row = mirror_rows.get(key, (None, None))
+
+            if dirty:
+                if mirror_row is None:
+                    new_row = [''] * len(mirror_headers)
+                    for header, value in zip(headers, values):
+                        if header in mirror_columns:
+                            new_row[mirror_columns[header] - 1] = value
+                    rows_to_push.append(new_row)
+                else:
+                    for header, value in zip(headers, values):
+                        col = mirror_columns.get(header)
+                        if col and (mirror_row[col - 1] if col <= len(mirror_row) else '') != value:
+                            cells_to_push.append((mirror_row_number, col, value))
+                pushed_versions[local_row] = dirty
+            elif mirror_row is None:
+                pulled_deletes.append(local_row)
+            else:
+                new_values = [
+                    (mirror_row[mirror_columns[header] - 1] if mirror_columns[header] <= len(mirror_row) else '')
+                    if header in mirror_columns else value
+                    for header, value in zip(headers, values)
+                ]
+                if new_values != values:
+                    pulled_updates[local_row] = new_values
+
+        pulled_inserts = []
+        for key, (_, mirror_row) in mirror_rows.items():
+            if key not in seen:
+                pulled_inserts.append([
+                    mirror_row[mirror_columns[header] - 1] if header in mirror_columns and mirror_columns[header] <= len(mirror_row) else ''
+                    for header in headers
+                ])
+
+        if cells_to_push:
+            self.sheets.update_cells(sheet_name, cells_to_push)
+        if rows_to_push:
+            self.sheets.append_rows(sheet_name, rows_to_push)
+        if pushed_versions:
+            self.store.mark_clean(sheet_name, pushed_versions)
+        if pulled_updates or pulled_deletes:
+            self.store.apply_mirror_changes(sheet_name, pulled_updates, pulled_deletes)
+        if pulled_inserts:
+            self.store.append_rows(sheet_name, pulled_inserts, dirty=False)
+
+        logger.info(
+            f"Synced sheet '{sheet_name}' with Google Sheets: pushed {len(pushed_versions)} rows, "
+            f"pulled {len(pulled_updates)} updates, {len(pulled_inserts)} inserts, {len(pulled_deletes)} deletes"
+        )
+        return bool(pulled_updates or pulled_inserts or pulled_deletes)
@@ -0,0 +1,294 @@
+import json
+import logging
+import sqlite3
+import threading
+
+import gspread
+from google.oauth2.service_account import Credentials
+
+from config import G_SHEET_CRED
+from sheets_client import QuotaAwareHTTPClient
+
+logger = logging.getLogger(__name__)
+
+# Хранилище, с которым работает SheetManager. Все методы блокирующие и вызываются
+# из пула потоков. Строки нумеруются как на листе Google: заголовки — строка 1,
+# данные начинаются со строки 2. Ячейки для update_cells — кортежи (строка, колонка, значение),
+# колонки нумеруются с 1.
+
+class SheetsBackend:
+    """Google Sheets через gspread."""
+
+    def __init__(self, spreadsheet_id, client=None):
+        self.client = client or self._get_client()
+        self.spreadsheet = self.client.open_by_key(spreadsheet_id)
+        self.worksheets = {worksheet.title: worksheet for worksheet in self.spreadsheet.worksheets()}
+
+    def _get_client(self):
+        scope = ['https://spreadsheets.google.com/feeds', 'https://www.googleapis.com/auth/drive']
+        if isinstance(G_SHEET_CRED, Credentials):
+            creds = G_SHEET_CRED
+        else:
+            creds = Credentials.from_service_account_info(json.loads(G_SHEET_CRED), scopes=scope)
+        return gspread.authorize(creds, http_client=QuotaAwareHTTPClient)
+
+    @property
+    def stats(self):
+        return dict(getattr(self.client.http_client, 'stats', {}))
+
+    def sheet_names(self):
+        return list(self.worksheets)
+
+    def headers(self, sheet_name):
+        return self.worksheets[sheet_name].row_values(1)
+
+    def get_all_values(self, sheet_name):
+        return self.worksheets[sheet_name].get_all_values()
+
+    def row_values(self, sheet_name, row_number):
+        return self.worksheets[sheet_name].row_values(row_number)
+
+    def get_all_sheets_values(self, sheet_names=None):
+        """Заголовки и данные листов (по умолчанию всех) одним запросом values:batchGet.
+
+        Диапазон каждого листа ограничен колонками его сетки; пустые ячейки
+        в конце строк Google не возвращает, поэтому строки дополняются до общей ширины.
+        """
+        titles = list(self.worksheets) if sheet_names is None else list(sheet_names)
+        ranges = []
+        for title in titles:
+            last_column = gspread.utils.rowcol_to_a1(1, max(self.worksheets[title].col_count, 1)).rstrip('1')
+            ranges.append(gspread.utils.absolute_range_name(title, f"A:{last_column}"))
+        value_ranges = self.spreadsheet.values_batch_get(ranges).get('valueRanges', [])
+        all_values = {}
+        for title, value_range in zip(titles, value_ranges):
+            values = value_range.get('values', [])
+            all_values[title] = gspread.utils.fill_gaps(values) if values else []
+        return all_values
+
+    def find(self, sheet_name, value, column):
+        cell = self.worksheets[sheet_name].find(str(value), in_column=column)
+        return cell.row if cell else None
+
+    def headers_and_column(self, sheet_name, column):
+        """Строка заголовков и значения колонки column (с 1) начиная со строки 2 — одним запросом."""
+        letter = gspread.utils.rowcol_to_a1(1, column).rstrip('1')
+        header_range, column_range = self.spreadsheet.values_batch_get(
+            [gspread.utils.absolute_range_name(sheet_name, '1:1'), gspread.utils.absolute_range_name(sheet_name, f"{letter}2:{letter}")],
+            params={'majorDimension': 'COLUMNS'}
+        )['valueRanges']
+        # По колонкам: заголовки приходят как [[h1], [h2], ...], колонка id — как [[id1, id2, ...]]
+        headers = [values[0] if values else '' for values in header_range.get('values', [])]
+        column_values = column_range.get('values', [[]])[0]
+        return headers, column_values
+
+    def ensure_sheet(self, sheet_name, headers):
+        """Возвращает заголовки листа, а если листа нет — создает его с заголовками headers."""
+        if sheet_name in self.worksheets:
+            return self.headers(sheet_name)
+        worksheet = self.spreadsheet.add_worksheet(sheet_name, rows=1, cols=len(headers))
+        worksheet.append_rows([list(headers)])
+        self.worksheets[sheet_name] = worksheet
+        logger.info(f"Created worksheet '{sheet_name}'")
+        return list(headers)
+
+    def delete_rows(self, sheet_name, row_numbers):
+        """Удаляет строки одним запросом batchUpdate; нижние строки сдвигаются вверх, как в интерфейсе Google."""
+        ranges = []
+        for row_number in sorted(row_numbers):
+            if ranges and ranges[-1][1] == row_number - 1:
+                ranges[-1][1] = row_number
+            else:
+                ranges.append([row_number, row_number])
+        sheet_id = self.worksheets[sheet_name].id
+        # Удаляем снизу вверх, чтобы номера еще не удаленных строк не сдвигались
+        self.spreadsheet.batch_update({'requests': [
+            {'deleteDimension': {'range': {'sheetId': sheet_id, 'dimension': 'ROWS', 'startIndex': start - 1, 'endIndex': end}}}
+            for start, end in reversed(ranges)
+        ]})
+
+    def append_rows(self, sheet_name, rows):
+        """Добавляет строки и возвращает номер первой из них (None, если Google его не сообщил)."""
+        response = self.worksheets[sheet_name].append_rows(rows)
+        # Google возвращает диапазон добавленных строк, например "Requests!A5:J6"
+        try:
+            updated_range = response['updates']['updatedRange']
+            first_row, _ = gspread.utils.a1_to_rowcol(updated_range.split('!')[-1].split(':')[0])
+        except (KeyError, TypeError, IndexError, gspread.exceptions.IncorrectCellLabel):
+            return None
+        return first_row
+
+    def update_cells(self, sheet_name, cells):
+        self.worksheets[sheet_name].update_cells([gspread.Cell(row, col, value) for row, col, value in cells])
+
+class SQLiteBackend:
+    """Локальная база SQLite: по таблице на лист, с индексами по id и полям фильтрации.
+
+    Колонка _row хранит номер строки в терминах листа, _dirty — счетчик изменений,
+    еще не переданных в зеркало Google Sheets (0 — строка совпадает с зеркалом).
+    """
+
+    def __init__(self, path, sheet_headers, indexed_fields):
+        self.path = path
+        self.indexed_fields = indexed_fields
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self._headers = {}
+        for sheet_name, headers in sheet_headers.items():
+            self.ensure_columns(sheet_name, headers)
+
+    @staticmethod
+    def _quote(name):
+        return '"' + name.replace('"', '""') + '"'
+
+    def ensure_columns(self, sheet_name, headers):
+        """Создает таблицу листа и добавляет недостающие колонки и индексы."""
+        with self._lock:
+            table = self._quote(sheet_name)
+            self.conn.execute(
+                f'CREATE TABLE IF NOT EXISTS {table} '
+                f'(_row INTEGER PRIMARY KEY, _dirty INTEGER NOT NULL DEFAULT 0)'
+            )
+            existing = [column[1] for column in self.conn.execute(f'PRAGMA table_info({table})')][2:]
+            for header in headers:
+                if header and header not in existing:
+                    self.conn.execute(f'ALTER TABLE {table} ADD COLUMN {self._quote(header)} TEXT NOT NULL DEFAULT \'\'')
+                    existing.append(header)
+            for field in self.indexed_fields.get(sheet_name, []):
+                if field in existing:
+                    self.conn.execute(
+                        f'CREATE INDEX IF NOT EXISTS {self._quote(f"idx_{sheet_name}_{field}")} '
+                        f'ON {table} ({self._quote(field)})'
+                    )
+            self.conn.execute(f'CREATE INDEX IF NOT EXISTS {self._quote(f"idx_{sheet_name}__dirty")} ON {table} (_dirty) WHERE _dirty > 0')
+            self._headers[sheet_name] = existing
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def sheet_names(self):
+        return list(self._headers)
+
+    def headers(self, sheet_name):
+        return list(self._headers[sheet_name])
+
+    def _columns(self, sheet_name):
+        return ', '.join(self._quote(header) for header in self._headers[sheet_name])
+
+    def get_all_values(self, sheet_name):
+        with self._lock:
+            rows = self.conn.execute(
+                f'SELECT _row, {self._columns(sheet_name)} FROM {self._quote(sheet_name)} ORDER BY _row'
+            ).fetchall()
+        # Позиция строки в результате должна совпадать с ее номером, поэтому
+        # на месте удаленных строк возвращаем пустые — как пустые строки на листе
+        all_values = [self.headers(sheet_name)]
+        empty_row = [''] * len(self._headers[sheet_name])
+        for row in rows:
+            while len(all_values) + 1 < row[0]:
+                all_values.append(list(empty_row))
+            all_values.append(list(row[1:]))
+        return all_values
+
+    def get_all_sheets_values(self, sheet_names=None):
+        return {sheet_name: self.get_all_values(sheet_name) for sheet_name in (self._headers if sheet_names is None else sheet_names)}
+
+    def headers_and_column(self, sheet_name, column):
+        all_values = self.get_all_values(sheet_name)
+        return all_values[0], [row[column - 1] for row in all_values[1:]]
+
+    def ensure_sheet(self, sheet_name, headers):
+        if sheet_name not in self._headers:
+            self.ensure_columns(sheet_name, headers)
+        return self.headers(sheet_name)
+
+    def delete_rows(self, sheet_name, row_numbers):
+        """Удаляет строки и сдвигает номера следующих, как при удалении строк на листе Google."""
+        deleted = sorted(set(row_numbers))
+        table = self._quote(sheet_name)
+        with self._lock, self.conn:
+            self.conn.executemany(f'DELETE FROM {table} WHERE _row = ?', [(row_number,) for row_number in deleted])
+            remaining = [row[0] for row in self.conn.execute(f'SELECT _row FROM {table} WHERE _row > ? ORDER BY _row', (deleted[0],))] if deleted else []
+            # Перенумеровываем по возрастанию: новый номер каждой строки уже свободен
+            shift = 0
+            for row_number in remaining:
+                while shift < len(deleted) and deleted[shift] < row_number:
+                    shift += 1
+                self.conn.execute(f'UPDATE {table} SET _row = ? WHERE _row = ?', (row_number - shift, row_number))
+
+    def row_values(self, sheet_name, row_number):
+        with self._lock:
+            row = self.conn.execute(
+                f'SELECT {self._columns(sheet_name)} FROM {self._quote(sheet_name)} WHERE _row = ?', (row_number,)
+            ).fetchone()
+        return list(row) if row else []
+
+    def find(self, sheet_name, value, column):
+        field = self._headers[sheet_name][column - 1]
+        with self._lock:
+            row = self.conn.execute(
+                f'SELECT _row FROM {self._quote(sheet_name)} WHERE {self._quote(field)} = ? ORDER BY _row LIMIT 1', (str(value),)
+            ).fetchone()
+        return row[0] if row else None
+
+    def append_rows(self, sheet_name, rows, dirty=True):
+        headers = self._headers[sheet_name]
+        placeholders = ', '.join('?' * (len(headers) + 2))
+        with self._lock:
+            next_row = self.conn.execute(f'SELECT COALESCE(MAX(_row), 1) + 1 FROM {self._quote(sheet_name)}').fetchone()[0]
+            values = []
+            for offset, row in enumerate(rows):
+                row = [str(value) for value in row[:len(headers)]]
+                row += [''] * (len(headers) - len(row))
+                values.append([next_row + offset, int(dirty)] + row)
+            with self.conn:
+                self.conn.executemany(
+                    f'INSERT INTO {self._quote(sheet_name)} (_row, _dirty, {self._columns(sheet_name)}) VALUES ({placeholders})',
+                    values
+                )
+        return next_row
+
+    def update_cells(self, sheet_name, cells, dirty=True):
+        headers = self._headers[sheet_name]
+        dirty_sql = ', _dirty = _dirty + 1' if dirty else ''
+        with self._lock, self.conn:
+            for row_number, col, value in cells:
+                self.conn.execute(
+                    f'UPDATE {self._quote(sheet_name)} SET {self._quote(headers[col - 1])} = ?{dirty_sql} WHERE _row = ?',
+                    (str(value), row_number)
+                )
+
+    # Методы для синхронизации с зеркалом Google Sheets
+
+    def rows_with_state(self, sheet_name):
+        """Возвращает [(номер строки, счетчик изменений, значения)] в порядке строк."""
+        with self._lock:
+            rows = self.conn.execute(
+                f'SELECT _row, _dirty, {self._columns(sheet_name)} FROM {self._quote(sheet_name)} ORDER BY _row'
+            ).fetchall()
+        return [(row[0], row[1], list(row[2:])) for row in rows]
+
+    def mark_clean(self, sheet_name, versions):
+        """Сбрасывает _dirty у строк, если с момента чтения их больше не меняли."""
+        with self._lock, self.conn:
+            self.conn.executemany(
+                f'UPDATE {self._quote(sheet_name)} SET _dirty = 0 WHERE _row = ? AND _dirty = ?',
+                list(versions.items())
+            )
+
+    def apply_mirror_changes(self, sheet_name, updates, deletes):
+        """Переносит правки из зеркала в строки, которые не менялись локально."""
+        headers = self._headers[sheet_name]
+        assignments = ', '.join(f'{self._quote(header)} = ?' for header in headers)
+        with self._lock, self.conn:
+            self.conn.executemany(
+                f'UPDATE {self._quote(sheet_name)} SET {assignments} WHERE _row = ? AND _dirty = 0',
+                [list(values) + [row_number] for row_number, values in updates.items()]
+            )
+            self.conn.executemany(
+                f'DELETE FROM {self._quote(sheet_name)} WHERE _row = ? AND _dirty = 0',
+                [(row_number,) for row_number in deletes]
+            )
@@ -0,0 +1,203 @@
+"""Журнал изменений и отложенная запись SheetManager на локальной копии Google Sheets.
+
+Запуск: python -m pytest test_sheet_manager.py (или python -m unittest test_sheet_manager)
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+os.environ.setdefault('ADMIN_ID_1', '0')
+os.environ.setdefault('ADMIN_ID_2', '0')
+
+from gspread.exceptions import APIError
+
+from config import (
+    SHEET_HEADERS, USERS_SHEET, REQUESTS_SHEET, REQUESTS_ARCHIVE_SHEET,
+    UserFields, RequestFields, RequestStatus
+)
+from fake_sheets import FakeClient, _FakeResponse
+from sheet_manager import SheetManager
+from storage import SheetsBackend
+
+def build_sheets():
+    sheets = {name: [list(headers)] for name, headers in SHEET_HEADERS.items() if name != REQUESTS_ARCHIVE_SHEET}
+    user = {UserFields.USER_ID: '1', UserFields.USERNAME: 'alice', UserFields.USER_STATUS: 'active'}
+    sheets[USERS_SHEET].append([user.get(field, '') for field in SHEET_HEADERS[USERS_SHEET]])
+    return sheets
+
+def new_request(request_id):
+    return {
+        RequestFields.REQUEST_ID: request_id,
+        RequestFields.USER_ID: '1',
+        RequestFields.AMOUNT: '100',
+        RequestFields.STATUS: RequestStatus.CHECK,
+    }
+
+class WriteBehindTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.wal_path = os.path.join(self.tmp_dir, 'wal.jsonl')
+        patcher = mock.patch('sheet_manager.WRITE_AHEAD_LOG_PATH', self.wal_path)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = FakeClient(build_sheets())
+        self.managers = []
+
+    async def asyncTearDown(self):
+        for manager in self.managers:
+            manager.wal.close()
+            manager._executor.shutdown(wait=True)
+        shutil.rmtree(self.tmp_dir)
+
+    def new_manager(self):
+        # Новый SheetManager на тех же таблице и журнале — как бот после перезапуска
+        manager = SheetManager('test', backend=SheetsBackend('test', client=self.client))
+        self.managers.append(manager)
+        return manager
+
+    def sheet_rows(self, sheet_name):
+        return self.client.spreadsheet.worksheet(sheet_name).rows
+
+    def request_rows(self, request_id):
+        return [row for row in self.sheet_rows(REQUESTS_SHEET)[1:] if row[0] == request_id]
+
+    def user_field(self, user_id, field):
+        rows = self.sheet_rows(USERS_SHEET)
+        index = rows[0].index(field)
+        return next(row[index] for row in rows[1:] if row[0] == user_id)
+
+    async def test_replay_after_crash(self):
+        manager = self.new_manager()
+        await manager.add_new_entry(REQUESTS_SHEET, new_request('r1'))
+        await manager.batch_update(USERS_SHEET, '1', {UserFields.USERNAME: 'bob'})
+        self.assertEqual(self.request_rows('r1'), [])
+
+        # Бот упал до отправки пачки: изменения есть только в журнале
+        restarted = self.new_manager()
+        self.assertEqual((await restarted.get_data(REQUESTS_SHEET, 'r1'))[RequestFields.AMOUNT], '100')
+        self.assertEqual((await restarted.get_data(USERS_SHEET, '1'))[UserFields.USERNAME], 'bob')
+
+        self.assertTrue(await restarted.flush())
+        self.assertEqual(len(self.request_rows('r1')), 1)
+        self.assertEqual(self.user_field('1', UserFields.USERNAME), 'bob')
+        self.assertEqual(restarted.wal.replay(), [])
+
+    async def test_flush_requeues_failed_batch(self):
+        manager = self.new_manager()
+        await manager.add_new_entry(REQUESTS_SHEET, new_request('r1'))
+        await manager.batch_update(USERS_SHEET, '1', {UserFields.USERNAME: 'bob'})
+
+        with mock.patch.object(SheetsBackend, 'append_rows', side_effect=APIError(_FakeResponse(503, 'Unavailable'))):
+            self.assertFalse(await manager.flush())
+        self.assertEqual(self.request_rows('r1'), [])
+        self.assertIn('r1', manager._pending_appends[REQUESTS_SHEET])
+        self.assertIn('1', manager._pending_updates[USERS_SHEET])
+        self.assertEqual(len(manager.wal.replay()), 2)
+
+        # Изменение, сделанное после неудачной отправки, не теряется и не перезаписывается старым
+        await manager.batch_update(USERS_SHEET, '1', {UserFields.USERNAME: 'carol'})
+        self.assertTrue(await manager.flush())
+        self.assertEqual(len(self.request_rows('r1')), 1)
+        self.assertEqual(self.user_field('1', UserFields.USERNAME), 'carol')
+        self.assertEqual(manager.wal.replay(), [])
+
+    async def test_partial_flush_recovery(self):
+        manager = self.new_manager()
+        await manager.add_new_entry(REQUESTS_SHEET, new_request('r1'))
+        await manager.batch_update(USERS_SHEET, '1', {UserFields.USERNAME: 'bob'})
+
+        # Новые строки дошли до таблицы, а обновление ячеек — нет
+        with mock.patch.object(SheetsBackend, 'update_cells', side_effect=APIError(_FakeResponse(503, 'Unavailable'))):
+            self.assertFalse(await manager.flush())
+        self.assertEqual(len(self.request_rows('r1')), 1)
+        self.assertEqual(self.user_field('1', UserFields.USERNAME), 'alice')
+        self.assertNotIn(REQUESTS_SHEET, manager._pending_appends)
+
+        # Перезапуск после частичной отправки: журнал переигрывается без повторного добавления строки
+        restarted = self.new_manager()
+        self.assertTrue(await restarted.flush())
+        self.assertEqual(len(self.request_rows('r1')), 1)
+        self.assertEqual(self.user_field('1', UserFields.USERNAME), 'bob')
+
+        await restarted.batch_update(REQUESTS_SHEET, 'r1', {RequestFields.STATUS: RequestStatus.RUN})
+        self.assertTrue(await restarted.flush())
+        status_index = SHEET_HEADERS[REQUESTS_SHEET].index(RequestFields.STATUS)
+        self.assertEqual(self.request_rows('r1')[0][status_index], RequestStatus.RUN)
+
+    async def test_blank_header_row_keeps_queued_rows(self):
+        manager = self.new_manager()
+        await manager.add_new_entry(REQUESTS_SHEET, new_request('r1'))
+        queued_row = list(manager._pending_appends[REQUESTS_SHEET]['r1'])
+
+        # Лист очистили: ни схема, ни строки в очереди не должны поменяться
+        worksheet = self.client.spreadsheet.worksheet(REQUESTS_SHEET)
+        worksheet.rows = []
+        await manager._reload_sheet(REQUESTS_SHEET)
+        self.assertEqual(manager._pending_appends[REQUESTS_SHEET]['r1'], queued_row)
+        self.assertEqual((await manager.get_data(REQUESTS_SHEET, 'r1'))[RequestFields.AMOUNT], '100')
+        self.assertFalse(await manager.flush())
+        self.assertEqual(len(manager.wal.replay()), 1)
+
+        worksheet.rows = [list(SHEET_HEADERS[REQUESTS_SHEET])]
+        self.assertTrue(await manager.flush())
+        self.assertEqual(self.request_rows('r1'), [queued_row])
+
+    async def test_headers_without_required_columns_are_refused(self):
+        manager = self.new_manager()
+        await manager.add_new_entry(REQUESTS_SHEET, new_request('r1'))
+        queued_row = list(manager._pending_appends[REQUESTS_SHEET]['r1'])
+
+        # Колонку статуса удалили: перестраивать строки под такую раскладку нельзя
+        worksheet = self.client.spreadsheet.worksheet(REQUESTS_SHEET)
+        worksheet.rows = [[field for field in SHEET_HEADERS[REQUESTS_SHEET] if field != RequestFields.STATUS]]
+        self.assertFalse(await manager.refresh_schema(REQUESTS_SHEET))
+        await manager._reload_sheet(REQUESTS_SHEET)
+        self.assertEqual(manager._pending_appends[REQUESTS_SHEET]['r1'], queued_row)
+        self.assertEqual(manager.field_indices[REQUESTS_SHEET][RequestFields.STATUS], SHEET_HEADERS[REQUESTS_SHEET].index(RequestFields.STATUS))
+        self.assertFalse(await manager.flush())
+        self.assertEqual(self.request_rows('r1'), [])
+
+    async def test_move_entries_after_rows_were_sorted(self):
+        requests = self.sheet_rows(REQUESTS_SHEET)
+        for request_id, status in (('r0', RequestStatus.DONE), ('r1', RequestStatus.CHECK), ('r2', RequestStatus.RUN)):
+            request = dict(new_request(request_id), **{RequestFields.STATUS: status})
+            requests.append([request.get(field, '') for field in SHEET_HEADERS[REQUESTS_SHEET]])
+        manager = self.new_manager()
+
+        append_rows = SheetsBackend.append_rows
+
+        def sort_during_archive_append(backend, sheet_name, rows):
+            # Администратор сортирует лист заявок, пока строки дописываются в архив
+            if sheet_name == REQUESTS_ARCHIVE_SHEET:
+                worksheet = self.client.spreadsheet.worksheet(REQUESTS_SHEET)
+                worksheet.rows[1:] = sorted(worksheet.rows[1:], reverse=True)
+            return append_rows(backend, sheet_name, rows)
+
+        with mock.patch.object(SheetsBackend, 'append_rows', sort_during_archive_append):
+            moved = await manager.move_entries(
+                REQUESTS_SHEET, REQUESTS_ARCHIVE_SHEET,
+                lambda request: request[RequestFields.STATUS] == RequestStatus.DONE
+            )
+        self.assertEqual([request[RequestFields.REQUEST_ID] for request in moved], ['r0'])
+        self.assertEqual([row[0] for row in self.sheet_rows(REQUESTS_SHEET)[1:]], ['r2', 'r1'])
+        self.assertEqual([row[0] for row in self.sheet_rows(REQUESTS_ARCHIVE_SHEET)[1:]], ['r0'])
+        self.assertEqual(sorted(await manager.ids(REQUESTS_SHEET)), ['r1', 'r2'])
+        self.assertEqual(manager.row_numbers[REQUESTS_SHEET], {'r2': 2, 'r1': 3})
+
+    async def test_wal_fsync_once_per_flush(self):
+        manager = self.new_manager()
+        with mock.patch('write_ahead_log.os.fsync') as fsync:
+            for request_id in ('r1', 'r2', 'r3'):
+                await manager.add_new_entry(REQUESTS_SHEET, new_request(request_id))
+            await manager.batch_update(USERS_SHEET, '1', {UserFields.USERNAME: 'bob'})
+            fsync.assert_not_called()
+            self.assertTrue(await manager.flush())
+            self.assertEqual(fsync.call_count, 1)
+            # Пустая пачка не трогает диск
+            self.assertTrue(await manager.flush())
+            self.assertEqual(fsync.call_count, 1)
+
+if __name__ == '__main__':
+    unittest.main()
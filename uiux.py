@@ -1,7 +1,7 @@
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardMarkup, InlineKeyboardButton
 from datetime import datetime
 import math
-from config import ButtonTexts, Messages, RequestStatus, RequestFields, UserFields
+from config import REQUESTS_PAGE_SIZE, ButtonTexts, Messages, RequestStatus, RequestFields, UserFields
 
 class UIUX:
     @staticmethod
@@ -80,7 +80,11 @@ class UIUX:
 
     @staticmethod
     def format_request(request, is_admin=False):
-        status_text = RequestStatus.CHECK_TEXT if request[RequestFields.STATUS] == RequestStatus.CHECK else RequestStatus.RUN_TEXT
+        status_text = {
+            RequestStatus.CHECK: RequestStatus.CHECK_TEXT,
+            RequestStatus.DONE: RequestStatus.DONE_TEXT,
+            RequestStatus.CANCEL: RequestStatus.CANCEL_TEXT,
+        }.get(request[RequestFields.STATUS], RequestStatus.RUN_TEXT)
         date = datetime.strptime(request[RequestFields.CREATED_AT], "%Y-%m-%dT%H:%M:%S.%f").strftime("%d %b %y")
         
         formatted_request = Messages.REQUEST_FORMAT.format(
@@ -107,6 +111,58 @@ class UIUX:
         
         return formatted_request
 
+    @staticmethod
+    def requests_page(requests, page, is_admin=False):
+        """Одна страница списка заявок: текст с карточками и клавиатура действий с листанием.
+
+        Номер страницы приводится к допустимому, если список успел сократиться.
+        """
+        pages = max(1, math.ceil(len(requests) / REQUESTS_PAGE_SIZE))
+        page = min(max(page, 0), pages - 1)
+        first = page * REQUESTS_PAGE_SIZE
+        page_requests = requests[first:first + REQUESTS_PAGE_SIZE]
+
+        cards = []
+        buttons = []
+        for number, request in enumerate(page_requests, start=first + 1):
+            cards.append(f"{number}. {UIUX.format_request(request, is_admin=is_admin)}")
+            request_id = request[RequestFields.REQUEST_ID]
+            if is_admin:
+                row = []
+                if request[RequestFields.STATUS] == RequestStatus.CHECK:
+                    row.append(InlineKeyboardButton(text=f"{number}. {ButtonTexts.ACCEPT_REQUEST}", callback_data=f"admin_accept_{request_id}_{page}"))
+                row.append(InlineKeyboardButton(text=f"{number}. {ButtonTexts.REJECT_REQUEST}", callback_data=f"admin_reject_{request_id}_{page}"))
+                if request[RequestFields.STATUS] == RequestStatus.RUN:
+                    row.append(InlineKeyboardButton(text=f"{number}. {ButtonTexts.COMPLETE_REQUEST}", callback_data=f"admin_complete_{request_id}_{page}"))
+                buttons.append(row)
+            else:
+                buttons.append([InlineKeyboardButton(text=f"{number}. {ButtonTexts.CANCEL_REQUEST}", callback_data=f"cancel_request_{request_id}_{page}")])
+
+        prefix = 'admin_requests_page' if is_admin else 'user_requests_page'
+        navigation = []
+        if page > 0:
+            navigation.append(InlineKeyboardButton(text=ButtonTexts.PREV_PAGE, callback_data=f"{prefix}_{page - 1}"))
+        if page < pages - 1:
+            navigation.append(InlineKeyboardButton(text=ButtonTexts.NEXT_PAGE, callback_data=f"{prefix}_{page + 1}"))
+        if navigation:
+            buttons.append(navigation)
+
+        text = Messages.REQUESTS_PAGE_HEADER.format(first=first + 1, last=first + len(page_requests), total=len(requests))
+        text += "\n\n".join(cards)
+        return text, InlineKeyboardMarkup(inline_keyboard=buttons)
+
+    @staticmethod
+    def parse_request_action(data):
+        """Разбирает callback вида `<действие>_<id>[_<страница>]` в (id, номер страницы или None).
+
+        Номер страницы есть только у кнопок из списка заявок: после действия
+        перерисовывается вся страница, а не одна карточка.
+        """
+        parts = data.split('_')
+        if len(parts) == 4:
+            return parts[2], int(parts[3])
+        return parts[-1], None
+
     @staticmethod
     def format_notification(message):
         return f"*Новое уведомление:*\n{message}"
@@ -0,0 +1,75 @@
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+class WriteAheadLog:
+    """Локальный журнал изменений таблиц, которые еще не записаны в Google Sheets.
+
+    Каждая запись — одна JSON-строка. Перед отправкой пачки в Sheets журнал
+    переносится в файл `<path>.flushing` и удаляется только после успешной записи,
+    поэтому при падении бота неотправленные изменения переигрываются при старте.
+
+    Запись попадает в ОС сразу, а fsync делается один раз на пачку (group commit)
+    методом sync из пула потоков, чтобы не блокировать цикл событий на каждом
+    изменении. Падение процесса записи не теряет; отключение питания — только
+    изменения последних WRITE_BEHIND_INTERVAL.
+    """
+
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.flushing_path = f"{path}.flushing"
+        self.fsync = fsync
+        self._dirty = False  # есть записи, еще не сброшенные на диск через fsync
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def append(self, record):
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self._file.flush()
+        self._dirty = True
+
+    def sync(self):
+        """Сбрасывает накопленные записи на диск. Вызывается из пула потоков."""
+        if not self.fsync or not self._dirty:
+            return
+        # Флаг снимается до fsync: запись, пришедшая во время сброса, попадет в следующий
+        self._dirty = False
+        os.fsync(self._file.fileno())
+
+    def replay(self):
+        records = []
+        for path in (self.flushing_path, self.path):
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding='utf-8') as f:
+                for line_number, line in enumerate(f, start=1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        records.append(json.loads(line))
+                    except json.JSONDecodeError:
+                        # Недописанная последняя строка после аварийного завершения
+                        logger.warning(f"Skipping corrupt write-ahead log record {path}:{line_number}")
+        return records
+
+    def rotate(self):
+        """Переносит текущий журнал в `.flushing` перед отправкой пачки в Sheets."""
+        self._file.close()
+        if os.path.exists(self.flushing_path):
+            # Предыдущая отправка не удалась — дописываем новые записи к старым
+            with open(self.path, encoding='utf-8') as src, open(self.flushing_path, 'a', encoding='utf-8') as dst:
+                dst.write(src.read())
+            os.remove(self.path)
+        else:
+            os.replace(self.path, self.flushing_path)
+        self._file = open(self.path, 'a', encoding='utf-8')
+
+    def commit(self):
+        """Удаляет записи, которые уже сохранены в Google Sheets."""
+        if os.path.exists(self.flushing_path):
+            os.remove(self.flushing_path)
+
+    def close(self):
+        self._file.close()